@@ -0,0 +1,64 @@
+"""Sentence spans and their on-disk cache, shared by pipeline and doc_tree."""
+
+import pytest
+
+spacy = pytest.importorskip("spacy")
+pytest.importorskip("pdfplumber")
+
+import doc_io
+
+TEXT = "  The buyer pays.  The seller ships the goods.\n\nDelivery ends it.  "
+
+
+@pytest.fixture
+def nlp():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_io, "SPANS_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_spans_are_trimmed_and_exclusive(nlp):
+    spans = doc_io.sentence_spans(TEXT, nlp)
+    assert [TEXT[a:b] for a, b in spans] == [
+        "The buyer pays.",
+        "The seller ships the goods.",
+        "Delivery ends it.",
+    ]
+
+
+def test_inclusive_spans_end_on_the_last_character(nlp, cache_dir):
+    exclusive = doc_io.document_spans(TEXT, nlp)
+    inclusive = doc_io.document_spans(TEXT, nlp, inclusive=True)
+    assert inclusive == [(a, b - 1) for a, b in exclusive]
+    assert [TEXT[a : b + 1] for a, b in inclusive] == [TEXT[a:b] for a, b in exclusive]
+
+
+def test_cache_is_reused_for_the_same_text(nlp, cache_dir, monkeypatch):
+    first = doc_io.document_spans(TEXT, nlp)
+    assert len(list(cache_dir.glob("sentences-*.json"))) == 1
+
+    def fail(*args):
+        raise AssertionError("spans were recomputed")
+
+    monkeypatch.setattr(doc_io, "sentence_spans", fail)
+    assert doc_io.document_spans(TEXT, nlp) == first
+
+
+def test_cache_key_covers_the_pipeline(nlp, cache_dir):
+    doc_io.document_spans(TEXT, nlp)
+    other = spacy.blank("en")
+    other.add_pipe("sentencizer", name="splitter")
+    doc_io.document_spans(TEXT, other)
+    assert len(list(cache_dir.glob("sentences-*.json"))) == 2
+
+
+def test_empty_cache_dir_disables_the_cache(nlp, tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_io, "SPANS_CACHE_DIR", "")
+    assert doc_io.document_spans(TEXT, nlp) == doc_io.sentence_spans(TEXT, nlp)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,59 @@
+"""The deterministic clean-up must reproduce each rule of the LLM prompt."""
+
+from kg_utils import infer_patch_edges
+
+
+def _edges(*triples):
+    return [{"source": s, "relation": r, "target": t} for s, r, t in triples]
+
+
+def test_if_statement_temporal_references():
+    patch = {
+        "nodes": [
+            {"id": "s1", "type": "Statement", "label": "IF paid BEFORE [w1] and AT noon [w2]"},
+            {"id": "s2", "type": "Statement", "label": "if paid at least 5 days after [w3]"},
+        ]
+    }
+    assert infer_patch_edges(patch) == _edges(
+        ("s1", "BEFORE", "w1"), ("s1", "AT", "w2"), ("s2", "AFTER", "w3")
+    )
+
+
+def test_if_check_needs_a_whole_word():
+    patch = {"nodes": [{"id": "s1", "type": "Statement", "label": "Iffy claims AFTER [w1]"}]}
+    assert infer_patch_edges(patch) == []
+
+
+def test_only_statements_get_temporal_edges():
+    patch = {"nodes": [{"id": "n1", "label": "IF paid BEFORE [w1]"}]}
+    assert infer_patch_edges(patch) == []
+
+
+def test_nested_time_anchors():
+    patch = {
+        "nodes": [
+            {"id": "w2", "label": "30 days after [w1]"},
+            {"id": "w3", "label": "the day Before [w2]"},
+        ]
+    }
+    assert infer_patch_edges(patch) == _edges(("w2", "AFTER", "w1"), ("w3", "BEFORE", "w2"))
+
+
+def test_if_then_surrogate_linking():
+    patch = {"nodes": [{"id": "s3", "type": "Statement", "label": "if [s1] then [s2]"}]}
+    assert infer_patch_edges(patch) == _edges(("s1", "ACTOR_IN", "s3"), ("s2", "OBJECT_IN", "s3"))
+
+
+def test_existing_and_repeated_triples_are_skipped():
+    patch = {
+        "nodes": [
+            {"id": "s1", "type": "Statement", "label": "IF BEFORE [w1] or BEFORE [w1] AFTER [w2]"},
+        ],
+        "edges": _edges(("s1", "AFTER", "w2")),
+    }
+    assert infer_patch_edges(patch) == _edges(("s1", "BEFORE", "w1"))
+
+
+def test_labels_without_references_add_nothing():
+    patch = {"nodes": [{"id": "s1", "type": "Statement", "label": "IF it rains THEN stay"}]}
+    assert infer_patch_edges(patch) == []
@@ -0,0 +1,230 @@
+"""Merging into the KG and writing it back: journal, sessions, atomic writes."""
+
+import json
+import os
+import stat
+
+import pytest
+
+from kg_utils import (
+    KG,
+    _read_kg,
+    _write_atomic,
+    clean_kg,
+    compact_kg,
+    consolidate_rules_to_topics,
+    kg_session,
+    update_kg,
+)
+
+
+def _write_kg(path, nodes=(), edges=()):
+    path.write_text(json.dumps({"nodes": list(nodes), "edges": list(edges)}), encoding="utf-8")
+
+
+def _triples(kg):
+    return [(e["source"], e["relation"], e["target"]) for e in kg["edges"]]
+
+
+@pytest.fixture
+def kg_path(tmp_path):
+    path = tmp_path / "final_kg.json"
+    _write_kg(
+        path,
+        nodes=[{"id": "n1", "label": "Buyer"}, {"id": "s1", "type": "Statement", "label": "pays"}],
+        edges=[{"source": "n1", "relation": "ACTOR_IN", "target": "s1", "edgeId": "e1"}],
+    )
+    return path
+
+
+# ---------------------------------------------------------------------------
+# _write_atomic
+# ---------------------------------------------------------------------------
+
+
+def test_write_atomic_replaces_content(tmp_path):
+    path = tmp_path / "out.json"
+    _write_atomic(path, b"first")
+    _write_atomic(path, b"second")
+    assert path.read_bytes() == b"second"
+    assert [p.name for p in tmp_path.iterdir()] == ["out.json"]
+
+
+def test_write_atomic_new_file_is_not_private(tmp_path):
+    path = tmp_path / "out.json"
+    _write_atomic(path, b"{}")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+
+def test_write_atomic_keeps_existing_mode(tmp_path):
+    path = tmp_path / "out.json"
+    path.write_bytes(b"old")
+    os.chmod(path, 0o600)
+    _write_atomic(path, b"new")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_write_atomic_leaves_no_temp_file_on_failure(tmp_path):
+    path = tmp_path / "out.json"
+    path.write_bytes(b"old")
+    with pytest.raises(TypeError):
+        _write_atomic(path, "not bytes")
+    assert path.read_bytes() == b"old"
+    assert [p.name for p in tmp_path.iterdir()] == ["out.json"]
+
+
+# ---------------------------------------------------------------------------
+# update_kg / clean_kg
+# ---------------------------------------------------------------------------
+
+
+def test_update_kg_renumbers_patch_ids(kg_path):
+    patch = {
+        "nodes": [
+            {"id": "n1", "label": "Seller"},
+            {"id": "s1", "type": "Statement", "label": "IF [n1] delivers"},
+        ],
+        "edges": [{"source": "n1", "relation": "ACTOR_IN", "target": "s1"}],
+    }
+    kg, id_map = update_kg(patch, kg_path, return_id_map=True)
+    assert id_map == {"n1": "n2", "s1": "s2"}
+    assert [n["id"] for n in kg["nodes"]] == ["n1", "s1", "n2", "s2"]
+    assert kg["nodes"][-1]["label"] == "IF [n2] delivers"
+    assert kg["edges"][-1] == {
+        "source": "n2", "relation": "ACTOR_IN", "target": "s2", "edgeId": "e2"
+    }
+    assert _read_kg(kg_path) == kg
+
+
+def test_update_kg_drops_duplicate_edges(kg_path):
+    graph = KG.load(kg_path)
+    patch = {
+        "nodes": [{"id": "x", "label": "kept id"}],
+        "edges": [
+            {"source": "n1", "relation": "ACTOR_IN", "target": "s1"},
+            {"source": "x", "relation": "REL", "target": "n1"},
+            {"source": "x", "relation": "REL", "target": "n1"},
+        ],
+    }
+    kg = update_kg(patch, kg_path, save=False, graph=graph)
+    assert _triples(kg) == [("n1", "ACTOR_IN", "s1"), ("x", "REL", "n1")]
+    # every patch edge drew an edgeId; the maximum follows the ones kept
+    assert kg["edges"][-1]["edgeId"] == "e3"
+    assert graph.edge_max == 3
+    assert ("x", "REL", "n1") in graph.edge_keys
+    # nothing was saved
+    assert len(_read_kg(kg_path)["nodes"]) == 2
+
+
+def test_update_kg_then_clean_kg_share_the_id_map(kg_path):
+    graph = KG.load(kg_path)
+    kg, id_map = graph.apply_patch(
+        {"nodes": [{"id": "n1", "label": "Seller"}], "edges": []}, return_id_map=True
+    )
+    graph.apply_edges(
+        {"edges_patch": [
+            {"source": "n1", "relation": "OBJECT_IN", "target": "s1"},
+            {"source": "n1", "relation": "REL", "target": "missing"},
+        ]},
+        id_map=id_map,
+    )
+    assert _triples(kg)[-1] == ("n2", "OBJECT_IN", "s1")
+    assert len(kg["edges"]) == 2
+    assert graph.node_max["n"] == 2
+
+
+def test_clean_kg_skips_known_nodes(kg_path):
+    kg = clean_kg({"nodes": [{"id": "n1", "label": "dup"}], "edges_patch": []}, kg_path)
+    assert [n["id"] for n in kg["nodes"]] == ["n1", "s1"]
+    assert kg["nodes"][0]["label"] == "Buyer"
+
+
+# ---------------------------------------------------------------------------
+# append journal
+# ---------------------------------------------------------------------------
+
+
+def test_append_mode_writes_journal_only(kg_path):
+    before = kg_path.read_bytes()
+    kg = update_kg({"nodes": [{"id": "n1", "label": "Seller"}]}, kg_path, mode="append")
+    journal = kg_path.with_suffix(".jsonl")
+    assert kg_path.read_bytes() == before
+    assert journal.exists()
+    assert _read_kg(kg_path) == kg
+
+
+def test_compact_kg_folds_journal_into_file(kg_path):
+    kg = update_kg({"nodes": [{"id": "n1", "label": "Seller"}]}, kg_path, mode="append")
+    assert compact_kg(kg_path) == kg
+    assert not kg_path.with_suffix(".jsonl").exists()
+    assert json.loads(kg_path.read_text(encoding="utf-8")) == kg
+
+
+def test_rewrite_mode_absorbs_existing_journal(kg_path):
+    update_kg({"nodes": [{"id": "n1", "label": "Seller"}]}, kg_path, mode="append")
+    kg = update_kg({"nodes": [{"id": "n1", "label": "Agent"}]}, kg_path)
+    assert [n["id"] for n in kg["nodes"]] == ["n1", "s1", "n2", "n3"]
+    assert not kg_path.with_suffix(".jsonl").exists()
+    assert json.loads(kg_path.read_text(encoding="utf-8")) == kg
+
+
+def test_unknown_mode_is_rejected(kg_path):
+    with pytest.raises(ValueError):
+        update_kg({"nodes": [{"id": "n1"}]}, kg_path, mode="stream")
+
+
+# ---------------------------------------------------------------------------
+# kg_session
+# ---------------------------------------------------------------------------
+
+
+def test_kg_session_writes_once_on_exit(kg_path):
+    update_kg({"nodes": [{"id": "n1", "label": "Seller"}]}, kg_path, mode="append")
+    before = kg_path.read_bytes()
+    with kg_session(kg_path) as graph:
+        graph.apply_patch({"nodes": [{"id": "n1", "label": "Agent"}]})
+        assert kg_path.read_bytes() == before
+    kg = json.loads(kg_path.read_text(encoding="utf-8"))
+    assert [n["id"] for n in kg["nodes"]] == ["n1", "s1", "n2", "n3"]
+    assert not kg_path.with_suffix(".jsonl").exists()
+
+
+def test_kg_session_leaves_file_alone_on_error(kg_path):
+    before = kg_path.read_bytes()
+    with pytest.raises(RuntimeError):
+        with kg_session(kg_path) as graph:
+            graph.apply_patch({"nodes": [{"id": "n1", "label": "Agent"}]})
+            raise RuntimeError
+    assert kg_path.read_bytes() == before
+
+
+# ---------------------------------------------------------------------------
+# consolidate_rules_to_topics
+# ---------------------------------------------------------------------------
+
+
+def test_consolidate_rules_keeps_kg_index_in_step():
+    graph = KG({
+        "nodes": [
+            {"id": "t1", "type": "Topic"},
+            {"id": "r1", "type": "Rule"},
+            {"id": "s1", "type": "Statement"},
+            {"id": "s2", "type": "Statement"},
+        ],
+        "edges": [
+            {"source": "t1", "relation": "HAS_STATEMENT", "target": "s1", "edgeId": "e1"},
+            {"source": "t1", "relation": "HAS_STATEMENT", "target": "s2", "edgeId": "e2"},
+            {"source": "r1", "relation": "HAS_CONDITION", "target": "s1", "edgeId": "e3"},
+            {"source": "r1", "relation": "HAS_CONCLUSION", "target": "s2", "edgeId": "e4"},
+        ],
+    })
+    kg = consolidate_rules_to_topics(graph)
+    assert kg is graph.data
+    assert _triples(kg) == [
+        ("r1", "HAS_CONDITION", "s1"),
+        ("r1", "HAS_CONCLUSION", "s2"),
+        ("t1", "HAS_STATEMENT", "r1"),
+    ]
+    assert kg["edges"][-1]["edgeId"] == "e5"
+    assert graph.edge_keys == set(_triples(kg))
+    assert graph.edge_max == 5
@@ -0,0 +1,111 @@
+"""Reply caches: what is persisted, and when the cache file is touched."""
+
+import json
+
+import pytest
+
+import llm_cache
+from llm_cache import ExactCache, SemanticCache
+
+
+class _Model:
+    model = "m"
+    temperature = 0
+
+
+class _WarmModel(_Model):
+    temperature = 0.7
+
+
+def test_exact_cache_round_trip(tmp_path):
+    path = tmp_path / "llm_cache.json"
+    cache = ExactCache(path)
+    cache.put(_Model, "prompt", "reply")
+    cache.save()
+    assert ExactCache(path).get(_Model, "prompt") == "reply"
+
+
+def test_exact_cache_reads_file_on_first_lookup(tmp_path):
+    path = tmp_path / "llm_cache.json"
+    path.write_text("not json", encoding="utf-8")
+    cache = ExactCache(path)  # would raise if the file were read here
+    path.write_text("{}", encoding="utf-8")
+    assert cache.get(_Model, "prompt") is None
+
+
+def test_exact_cache_put_before_get_keeps_stored_entries(tmp_path):
+    path = tmp_path / "llm_cache.json"
+    first = ExactCache(path)
+    first.put(_Model, "a", "1")
+    first.save()
+    cache = ExactCache(path)
+    cache.put(_Model, "b", "2")
+    assert cache.get(_Model, "a") == "1"
+    assert cache.get(_Model, "b") == "2"
+
+
+def test_exact_cache_skips_sampled_models(tmp_path):
+    path = tmp_path / "llm_cache.json"
+    cache = ExactCache(path)
+    cache.put(_WarmModel, "prompt", "reply")
+    assert cache.get(_WarmModel, "prompt") is None
+    cache.save()
+    assert not path.exists()
+
+
+def test_exact_cache_evicts_least_recently_used(tmp_path):
+    cache = ExactCache(None, maxsize=2)
+    cache.put(_Model, "a", "1")
+    cache.put(_Model, "b", "2")
+    cache.get(_Model, "a")
+    cache.put(_Model, "c", "3")
+    assert cache.get(_Model, "a") == "1"
+    assert cache.get(_Model, "b") is None
+
+
+def test_exact_cache_save_only_when_dirty(tmp_path):
+    path = tmp_path / "llm_cache.json"
+    path.write_text(json.dumps({}), encoding="utf-8")
+    cache = ExactCache(path)
+    cache.get(_Model, "prompt")
+    path.unlink()
+    cache.save()
+    assert not path.exists()
+
+
+class _OneHotEncoder:
+    """Stand-in for SentenceTransformer: each distinct key gets its own axis."""
+
+    def __init__(self, np):
+        self.np = np
+        self.axes = {}
+
+    def encode(self, key, normalize_embeddings=True):
+        vec = self.np.zeros(8, dtype=self.np.float32)
+        vec[self.axes.setdefault(key, len(self.axes))] = 1.0
+        return vec
+
+
+@pytest.fixture
+def semantic(monkeypatch):
+    np = pytest.importorskip("numpy")
+    monkeypatch.setattr(llm_cache, "np", np)
+    monkeypatch.setattr(llm_cache, "SentenceTransformer", object)
+    monkeypatch.setattr(llm_cache, "_encoder", _OneHotEncoder(np))
+
+
+def test_semantic_cache_round_trip(tmp_path, semantic):
+    cache = SemanticCache("labels", directory=tmp_path)
+    cache.put("the buyer pays", "Payment")
+    cache.save()
+    loaded = SemanticCache("labels", directory=tmp_path)
+    assert loaded.get("the buyer pays") == (True, "Payment")
+    assert loaded.get("the seller ships") == (False, None)
+
+
+def test_semantic_cache_drops_mismatched_files(tmp_path, semantic):
+    cache = SemanticCache("labels", directory=tmp_path)
+    cache.put("the buyer pays", "Payment")
+    cache.save()
+    (tmp_path / "labels.json").write_text('["Payment", "Extra"]', encoding="utf-8")
+    assert SemanticCache("labels", directory=tmp_path).get("the buyer pays") == (False, None)
@@ -0,0 +1,31 @@
+"""A batched ontology reply is only used when it has one graph per input."""
+
+import pytest
+
+pytest.importorskip("langchain_ollama")
+
+from LLMs import _split_batch_reply
+
+
+def test_graphs_object_in_fence_after_think_block():
+    reply = '<think>two texts</think>```json\n{"graphs": [{"nodes": []}, {"edges": []}]}\n```'
+    assert _split_batch_reply(reply, 2) == [{"nodes": []}, {"edges": []}]
+
+
+def test_bare_array_is_accepted():
+    assert _split_batch_reply('Here you go: [{"nodes": []}]', 1) == [{"nodes": []}]
+
+
+@pytest.mark.parametrize(
+    "reply",
+    [
+        '{"graphs": [{"nodes": []}]}',  # too few
+        '{"graphs": [{}, {}, {}]}',  # too many
+        "[1, 2]",  # not graphs
+        '{"graphs": "none"}',
+        '{"graphs": [{}, ',  # truncated
+        "no json at all",
+    ],
+)
+def test_malformed_replies_are_rejected(reply):
+    assert _split_batch_reply(reply, 2) is None
@@ -1,13 +1,84 @@
-from langchain_ollama import ChatOllama
+from langchain_ollama import ChatOllama, OllamaLLM
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import PromptTemplate
-import re
 import json
+import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from kg_utils import _extract_json_block
+from kg_utils import _JSON_DECODER, _parse_llm_json, _strip_fence
+from llm_cache import ExactCache, SemanticCache
 
-def simplify_text(text: str, model) -> str:
-    prompt_template = PromptTemplate.from_template(
+_THINK_RE = re.compile(r"<think>.*?</think>\s*", re.DOTALL)
+_FIRST_INT_RE = re.compile(r"-?\d+")
+_LABEL_PREFIX_RE = re.compile(r"^(?:node\s*label|label)\s*:\s*", re.I)
+
+_LLM_CACHE = ExactCache()
+_LABEL_CACHE = SemanticCache("label_text")
+_TOPIC_SAME_CACHE = SemanticCache("sentence_topic_same")
+
+
+def set_cache(cache: ExactCache) -> None:
+    """Replace the reply cache used by every helper in this module."""
+    global _LLM_CACHE
+    _LLM_CACHE = cache
+
+
+def disable_cache() -> None:
+    """Stop reading and writing the on-disk reply cache for this process.
+
+    Replies are still shared in memory, so identical prompts within one run
+    reach the model once.
+    """
+    set_cache(ExactCache(path=None))
+
+
+def _json_mode(model) -> dict:
+    """Invoke kwargs asking *model* for grammar-constrained JSON output.
+
+    Ollama then only samples valid JSON (no fences, chatter or think block),
+    which also keeps replies short. Other providers get no extra kwargs.
+    """
+    if isinstance(model, (OllamaLLM, ChatOllama)):
+        return {"format": "json"}
+    return {}
+
+
+def _invoke(model, prompt: str, **kwargs) -> str:
+    """``model.invoke`` with replies memoised in the exact-match cache."""
+    reply = _LLM_CACHE.get(model, prompt)
+    if reply is None:
+        reply = model.invoke(prompt, **kwargs)
+        _LLM_CACHE.put(model, prompt, reply)
+    return reply
+
+
+def _batch(model, prompts: List[str], max_concurrency: int, **kwargs) -> List[str]:
+    """Invoke *model* on every prompt, up to *max_concurrency* requests at once.
+
+    Only prompts missing from the exact cache are sent. Repeated prompts
+    (e.g. boilerplate clauses occurring twice in a document) are sent once
+    and the reply is shared. ``model.batch`` is not used: for ``BaseLLM``
+    subclasses such as OllamaLLM it hands each sub-batch to ``_generate``,
+    which sends the prompts one after another.
+    """
+    replies = [_LLM_CACHE.get(model, p) for p in prompts]
+    misses = list(dict.fromkeys(p for p, r in zip(prompts, replies) if r is None))
+    if misses:
+        workers = max(1, min(max_concurrency, len(misses)))
+        # the sync clients are thread-safe and pool their connections
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            fresh = list(pool.map(lambda p: model.invoke(p, **kwargs), misses))
+        answered = dict(zip(misses, fresh))
+        for prompt, reply in answered.items():
+            _LLM_CACHE.put(model, prompt, reply)
+        replies = [answered[p] if r is None else r for p, r in zip(prompts, replies)]
+    return replies
+
+
+# Prompt templates are built once and keep their fixed instructions ahead of
+# the per-call input, so consecutive requests share a byte-identical prefix
+# that Ollama can reuse from its KV cache instead of prefilling it again.
+_SIMPLIFY_TEMPLATE = PromptTemplate.from_template(
 """
 ############################################################
 # ATOMIC FACT & LOGIC-MAP EXTRACTOR #
@@ -111,12 +182,19 @@ DATA
 {input}  
 </input>
 """)
-    prompt = prompt_template.format(input=text)
+
+
+def simplify_text(text: str, model) -> str:
+    prompt = _SIMPLIFY_TEMPLATE.format(input=text)
     return model.invoke(prompt)
 
-def create_knowledge_ontology(text: str, model) -> str:
-    prompt_template = PromptTemplate.from_template(
-"""
+
+def simplify_text_many(texts: List[str], model, max_concurrency: int = 8) -> List[str]:
+    """`simplify_text` for every item of *texts*, up to *max_concurrency* at once."""
+    prompts = [_SIMPLIFY_TEMPLATE.format(input=t) for t in texts]
+    return _batch(model, prompts, max_concurrency)
+
+_ONTOLOGY_RULES = """
 ############################################################
 # FACT-BLOCK → KNOWLEDGE-GRAPH JSON #
 ############################################################
@@ -235,32 +313,149 @@ s4 - the test occurs [WHEN = w1].
 ############################################################
 # END OF PROMPT #
 ############################################################
+"""
 
+_ONTOLOGY_TEMPLATE = PromptTemplate.from_template(
+    _ONTOLOGY_RULES + "\n\n<FACTS>{facts}</FACTS>\n"
+)
+
+_ONTOLOGY_BATCH_TEMPLATE = PromptTemplate.from_template(
+    _ONTOLOGY_RULES
+    + """
+BATCH MODE
+Below are {count} numbered <FACTS> blocks instead of one. Apply every rule
+above to each block on its own (IDs restart at n1, s1, w1, r1 per block)
+and return **one JSON object** {{"graphs": [ … ]}} whose array holds
+exactly {count} graphs, element i being the graph for block i. Output
+that object only.
+
+{blocks}
+"""
+)
+
+
+# Character budget for the FACTS blocks of one batch prompt. Packing many
+# long blocks makes the model more likely to drop or merge a graph, which
+# sends the whole batch back through one-block retries.
+ONTOLOGY_BATCH_MAX_CHARS = 2000
+
+
+def create_knowledge_ontology(text: str, model) -> str:
+    prompt = _ONTOLOGY_TEMPLATE.format(facts=text)
+    return model.invoke(prompt, **_json_mode(model))
+
+
+def _split_batch_reply(reply: str, count: int) -> List[dict] | None:
+    """Return the *count* graphs of a batch reply, or ``None`` if malformed."""
+    text = _strip_fence(remove_think_block(reply))
+    # {"graphs": [...]} as asked, or a bare array from a model not in JSON mode
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return None
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(text, min(starts))
+    except ValueError:
+        return None
+    graphs = obj.get("graphs") if isinstance(obj, dict) else obj
+    if not isinstance(graphs, list) or len(graphs) != count:
+        return None
+    if not all(isinstance(g, dict) for g in graphs):
+        return None
+    return graphs
+
+
+def create_knowledge_ontology_batch(
+    texts: List[str], model, batch_size: int = 8, max_concurrency: int = 4
+) -> List[str]:
+    """Run `create_knowledge_ontology` over *texts*, *batch_size* per LLM call.
+
+    Consecutive texts are packed until *batch_size* or
+    ``ONTOLOGY_BATCH_MAX_CHARS`` is reached, so a long text gets a call of
+    its own. Up to *max_concurrency* batch prompts are in flight at once. Returns one
+    reply string per input, in order. A batch whose reply is not a JSON
+    array of the right length is redone one block at a time. Repeated texts
+    (page headers, boilerplate) are extracted once and the reply is shared.
+    """
+    unique = list(dict.fromkeys(texts))
+    if len(unique) < len(texts):
+        replies = create_knowledge_ontology_batch(unique, model, batch_size, max_concurrency)
+        by_text = dict(zip(unique, replies))
+        return [by_text[t] for t in texts]
+
+    chunks: List[List[str]] = []
+    size = 0
+    for t in texts:
+        if (
+            not chunks
+            or len(chunks[-1]) == batch_size
+            or size + len(t) > ONTOLOGY_BATCH_MAX_CHARS
+        ):
+            chunks.append([])
+            size = 0
+        chunks[-1].append(t)
+        size += len(t)
+    prompts = []
+    for chunk in chunks:
+        if len(chunk) == 1:
+            prompts.append(_ONTOLOGY_TEMPLATE.format(facts=chunk[0]))
+            continue
+        blocks = "\n".join(
+            f'<FACTS n="{n}">{t}</FACTS>' for n, t in enumerate(chunk, start=1)
+        )
+        prompts.append(_ONTOLOGY_BATCH_TEMPLATE.format(count=len(chunk), blocks=blocks))
+
+    replies: List[str | None] = []
+    json_mode = _json_mode(model)
+    batch_replies = _batch(model, prompts, max_concurrency, **json_mode)
+    for chunk, reply in zip(chunks, batch_replies):
+        if len(chunk) == 1:
+            replies.append(reply)
+            continue
+        graphs = _split_batch_reply(reply, len(chunk))
+        if graphs is None:
+            replies.extend([None] * len(chunk))
+        else:
+            replies.extend(json.dumps(g, ensure_ascii=False) for g in graphs)
+
+    # Retry the blocks of malformed batches individually
+    retry = [i for i, r in enumerate(replies) if r is None]
+    if retry:
+        singles = [_ONTOLOGY_TEMPLATE.format(facts=texts[i]) for i in retry]
+        fresh = _batch(model, singles, max_concurrency, **json_mode)
+        for i, reply in zip(retry, fresh):
+            replies[i] = reply
+    return replies
 
-<FACTS>{facts}</FACTS>
-""")
-    prompt = prompt_template.format(facts=text)
-    return model.invoke(prompt)
 
 def remove_think_block(text: str) -> str:
     # Remove <think>...</think> including the tags
-    return re.sub(r"<think>.*?</think>\s*", "", text, flags=re.DOTALL)
+    start = text.find("<think>")
+    if start == -1:  # non-reasoning models: skip the regex engine
+        return text
+    end = text.find("</think>", start)
+    if end == -1:
+        return text
+    # reasoning models emit one leading block; slice it out and only fall
+    # back to the regex if more follow
+    rest = text[end + len("</think>") :].lstrip()
+    if "<think>" in rest:
+        rest = _THINK_RE.sub("", rest)
+    return text[:start] + rest
 
 
 def clean_label(text: str) -> str:
     """Return *text* without think blocks, quotes, or markup prefixes."""
     text = remove_think_block(text).strip()
     # Remove leading 'Node Label:' or 'Label:' style prefixes
-    text = re.sub(r'^(?:node\s*label|label)\s*:\s*', "", text, flags=re.I)
+    text = _LABEL_PREFIX_RE.sub("", text)
     # Strip common quote or emphasis markers
     if text.startswith("**") and text.endswith("**"):
         text = text[2:-2]
     text = text.strip("\"'`*")
     return text.strip()
 
-def clean_up_1st_phase(text: str, model):
-    prompt_template = PromptTemplate.from_template(
-        """
+_CLEAN_UP_TEMPLATE = PromptTemplate.from_template(
+    """
 ############################################################
 # JSON-GRAPH CLEAN-UP  ➜  ADD-MISSING EDGES
 ############################################################
@@ -312,18 +507,20 @@ OUTPUT CHECKLIST  (remove before running)
 {input}
 </input>
 """)
-    prompt = prompt_template.format(input=text)
-    return model.invoke(prompt)
 
-def one_sentence_summary(text: str, model) -> str:
-    """
-    Ask the LLM to rewrite *text* as a single, information-complete sentence.
 
-    Returns the raw sentence (stripped).  Raises ValueError if the reply
-    contains line-breaks or multiple sentences.
+def clean_up_1st_phase(text: str, model):
+    prompt = _CLEAN_UP_TEMPLATE.format(input=text)
+    return model.invoke(prompt, **_json_mode(model))
+
+
+def clean_up_1st_phase_many(texts: list, model, max_concurrency: int = 8) -> List[str]:
+    """`clean_up_1st_phase` for every item of *texts*, up to *max_concurrency* at once."""
+    prompts = [_CLEAN_UP_TEMPLATE.format(input=t) for t in texts]
+    return _batch(model, prompts, max_concurrency, **_json_mode(model))
+
+_SUMMARY_TEMPLATE = PromptTemplate.from_template(
     """
-    prompt_template = PromptTemplate.from_template(
-        """
 ############################################################
 # ONE-SENTENCE COMPREHENSIVE SUMMARY
 ############################################################
@@ -339,8 +536,17 @@ RULES
 {text}
 </INPUT>
 """
-    )
-    prompt = prompt_template.format(text=text)
+)
+
+
+def one_sentence_summary(text: str, model) -> str:
+    """
+    Ask the LLM to rewrite *text* as a single, information-complete sentence.
+
+    Returns the raw sentence (stripped).  Raises ValueError if the reply
+    contains line-breaks or multiple sentences.
+    """
+    prompt = _SUMMARY_TEMPLATE.format(text=text)
     reply = model.invoke(prompt).strip()
     reply  = remove_think_block(reply).strip()
 
@@ -350,22 +556,8 @@ RULES
     return reply
 
 
-def propose_split_spans(
-    text: str,
-    model,
-) -> List[dict]:
-    """
-    Ask the LLM to suggest 2–max_segments non-overlapping character-offset
-    spans that together cover *text*.
-
-    The model must return:
-      { "spans": [ { "start": int, "end": int }, … ] }
-
-    *If the model uses half-open slices [start,end), they are converted to
-    inclusive end indices.*
+_SPLIT_SPANS_TEMPLATE = PromptTemplate.from_template(
     """
-    prompt_template = PromptTemplate.from_template(
-        """
 SYSTEM
 You are “DeepSegment-2”.  
 Return only raw JSON; stop after you output it.
@@ -407,15 +599,30 @@ Create **two** coherent segments that together cover **all** characters in <INPU
 </INPUT>
 
 """
-    )
-    prompt = prompt_template.format(text=text)
-    raw_reply = model.invoke(prompt).strip()
-    reply = remove_think_block(raw_reply)
-    reply = _extract_json_block(reply)
+)
+
+
+def propose_split_spans(
+    text: str,
+    model,
+) -> List[dict]:
+    """
+    Ask the LLM to suggest 2–max_segments non-overlapping character-offset
+    spans that together cover *text*.
+
+    The model must return:
+      { "spans": [ { "start": int, "end": int }, … ] }
+
+    *If the model uses half-open slices [start,end), they are converted to
+    inclusive end indices.*
+    """
+    prompt = _SPLIT_SPANS_TEMPLATE.format(text=text)
+    raw_reply = model.invoke(prompt, **_json_mode(model)).strip()
+    reply = remove_think_block(raw_reply).strip()
 
     # -------- parse ------------------------------------------------------
     try:
-        spans = json.loads(reply)["spans"]
+        spans = _parse_llm_json(reply)["spans"]
     except Exception as e:
         raise ValueError(f"LLM did not return valid JSON:\n{reply}") from e
 
@@ -447,20 +654,112 @@ Create **two** coherent segments that together cover **all** characters in <INPU
     return spans
 
 
+_LABEL_TEMPLATE = PromptTemplate.from_template(
+    "Give a concise node label (<= 12 words) describing the following text:\n\n{text}"
+)
+
+
 def label_text(text: str, model) -> str:
     """Return a short label describing *text*."""
-    prompt_template = PromptTemplate.from_template(
-        "Give a concise node label (<= 12 words) describing the following text:\n\n{text}"
-    )
-    prompt = prompt_template.format(text=text)
-    return model.invoke(prompt)
+    hit, reply = _LABEL_CACHE.get(text)
+    if hit:
+        return reply
+    prompt = _LABEL_TEMPLATE.format(text=text)
+    reply = _invoke(model, prompt)
+    _LABEL_CACHE.put(text, reply)
+    return reply
+
+
+def label_text_many(texts: List[str], model, max_concurrency: int = 8) -> List[str]:
+    """`label_text` for every item of *texts*, up to *max_concurrency* at once
+    (see ``_batch``).
+
+    Only texts missing from the cache are sent to the model; replies are
+    returned in the order of *texts*.
+    """
+    labels: List[str | None] = []
+    for t in texts:
+        hit, reply = _LABEL_CACHE.get(t)
+        labels.append(reply if hit else None)
+
+    misses = [i for i, v in enumerate(labels) if v is None]
+    if misses:
+        prompts = [_LABEL_TEMPLATE.format(text=texts[i]) for i in misses]
+        replies = _batch(model, prompts, max_concurrency)
+        for i, reply in zip(misses, replies):
+            labels[i] = reply
+            _LABEL_CACHE.put(texts[i], reply)
+    return labels
+
+
+_TOPIC_SAME_TEMPLATE = PromptTemplate.from_template(
+    "Topic: {topic}\nSentence: {sentence}\nDoes the sentence elaborate on this topic? Answer yes or no."
+)
 
 
 def sentence_topic_same(topic: str, sentence: str, model) -> bool:
     """Determine whether *sentence* elaborates on *topic*."""
-    prompt_template = PromptTemplate.from_template(
-        "Topic: {topic}\nSentence: {sentence}\nDoes the sentence elaborate on this topic? Answer yes or no."
-    )
-    prompt = prompt_template.format(topic=topic, sentence=sentence)
-    reply = model.invoke(prompt)
-    return reply.lower().startswith("yes")
+    hit, same = _TOPIC_SAME_CACHE.get(f"{topic}|{sentence}")
+    if hit:
+        return same
+    prompt = _TOPIC_SAME_TEMPLATE.format(topic=topic, sentence=sentence)
+    reply = _invoke(model, prompt)
+    same = reply.lower().startswith("yes")
+    _TOPIC_SAME_CACHE.put(f"{topic}|{sentence}", same)
+    return same
+
+
+def sentence_topic_same_many(
+    topic: str, sentences: List[str], model, max_concurrency: int = 8
+) -> List[bool]:
+    """Classify several *sentences* against *topic* concurrently.
+
+    Up to *max_concurrency* requests are in flight at once (see ``_batch``).
+    Results are returned in the order of *sentences*; only sentences missing
+    from the cache are sent to the model.
+    """
+    verdicts: List[bool | None] = []
+    for s in sentences:
+        hit, same = _TOPIC_SAME_CACHE.get(f"{topic}|{s}")
+        verdicts.append(same if hit else None)
+
+    misses = [i for i, v in enumerate(verdicts) if v is None]
+    if misses:
+        prompts = [
+            _TOPIC_SAME_TEMPLATE.format(topic=topic, sentence=sentences[i]) for i in misses
+        ]
+        replies = _batch(model, prompts, max_concurrency)
+        for i, reply in zip(misses, replies):
+            verdicts[i] = reply.lower().startswith("yes")
+            _TOPIC_SAME_CACHE.put(f"{topic}|{sentences[i]}", verdicts[i])
+    return verdicts
+
+
+_FIRST_OFF_TOPIC_TEMPLATE = PromptTemplate.from_template(
+    "Topic: {topic}\n\nSentences:\n{sentences}\n\n"
+    "Return the number of the first sentence that does NOT elaborate on this topic. "
+    "If every sentence elaborates on it, answer ALL. Answer with the number or ALL only."
+)
+
+
+def find_first_off_topic(topic: str, sentences: List[str], model) -> int | None:
+    """Return the index of the first of *sentences* not about *topic*.
+
+    All sentences are judged in a single prompt. Returns ``-1`` when every
+    sentence elaborates on *topic* and ``None`` when the reply cannot be
+    parsed, so callers can fall back to per-sentence classification.
+    """
+    numbered = "\n".join(f"{i}) {s}" for i, s in enumerate(sentences, start=1))
+    prompt = _FIRST_OFF_TOPIC_TEMPLATE.format(topic=topic, sentences=numbered)
+    reply = remove_think_block(_invoke(model, prompt)).strip()
+    if reply.upper().startswith("ALL"):
+        return -1
+    m = _FIRST_INT_RE.search(reply)
+    if m is None:
+        return None
+    idx = int(m.group())
+    if idx == -1:  # the usual "none of them" answer, despite asking for ALL
+        return -1
+    if not 1 <= idx <= len(sentences):
+        return None
+    return idx - 1
@@ -1,6 +1,7 @@
-import json
 from pathlib import Path
 
+from kg_utils import _read_kg
+
 def clean_relation(s):
     return s.upper().replace(" ", "_").replace("-", "_")
 
@@ -10,66 +11,71 @@ file_path = BASE_DIR / "structured"
 input = file_path / "final_kg.json"
 output = file_path / "import_kg.cypher"
 
-# Load your merged knowledge graph
-with open(input, "r", encoding="utf-8") as f:
-    kg = json.load(f)
-
 # Helper to clean labels
 def escape(s):
     return s.replace('"', '\\"')
 
-cypher_nodes = []
-cypher_edges = []
-
-# Use a set to track all created nodes (avoid duplicate CREATEs)
-node_ids = set()
-
-# Here: NO "for graph in kg"
-for node in kg["nodes"]:
-    nid = node["id"]
-    # Not all nodes are guaranteed to carry a `label` field.  If it's
-    # missing we fall back to an empty string so the conversion still
-    # succeeds rather than failing with a KeyError.
-    label = escape(node.get("label", ""))
-
-    # Avoid duplicating the same node
-    if nid in node_ids:
-        continue
-    node_ids.add(nid)
-
-    props = {k: v for k, v in node.items() if k not in ["id", "label", "type"]}
-    # Also handle nested attributes
-    if "attributes" in props:
-        attrs = props.pop("attributes")
-        props.update(attrs)
-
-    node_label = node.get("type", "Entity")
-
-    prop_str = ""
-    if props:
-        prop_pairs = [f'{k}: "{v}"' if isinstance(v, str) else f'{k}: {v}' for k, v in props.items()]
-        prop_str = ", " + ", ".join(prop_pairs)
-
-    cypher_nodes.append(
-        f'CREATE (:{clean_relation(node_label)} {{id: "{nid}", label: "{label}"{prop_str}}});'
-    )
-
-for edge in kg["edges"]:
-    src = edge["source"]
-    tgt = edge["target"]
-    rel = clean_relation(escape(edge["relation"]))
-    attr_str = ""
-    if "attributes" in edge and edge["attributes"]:
-        attr_pairs = [f'{k}: "{v}"' if isinstance(v, str) else f'{k}: {v}' for k, v in edge["attributes"].items()]
-        attr_str = " { " + ", ".join(attr_pairs) + " }"
-
-    cypher_edges.append(
-        f'''
+
+def main():
+    # Load your merged knowledge graph, including any append journal
+    kg = _read_kg(input)
+
+    cypher_nodes = []
+    cypher_edges = []
+
+    # Use a set to track all created nodes (avoid duplicate CREATEs)
+    node_ids = set()
+
+    # Here: NO "for graph in kg"
+    for node in kg["nodes"]:
+        nid = node["id"]
+        # Not all nodes are guaranteed to carry a `label` field.  If it's
+        # missing we fall back to an empty string so the conversion still
+        # succeeds rather than failing with a KeyError.
+        label = escape(node.get("label", ""))
+
+        # Avoid duplicating the same node
+        if nid in node_ids:
+            continue
+        node_ids.add(nid)
+
+        props = {k: v for k, v in node.items() if k not in ["id", "label", "type"]}
+        # Also handle nested attributes
+        if "attributes" in props:
+            attrs = props.pop("attributes")
+            props.update(attrs)
+
+        node_label = node.get("type", "Entity")
+
+        prop_str = ""
+        if props:
+            prop_pairs = [f'{k}: "{v}"' if isinstance(v, str) else f'{k}: {v}' for k, v in props.items()]
+            prop_str = ", " + ", ".join(prop_pairs)
+
+        cypher_nodes.append(
+            f'CREATE (:{clean_relation(node_label)} {{id: "{nid}", label: "{label}"{prop_str}}});'
+        )
+
+    for edge in kg["edges"]:
+        src = edge["source"]
+        tgt = edge["target"]
+        rel = clean_relation(escape(edge["relation"]))
+        attr_str = ""
+        if "attributes" in edge and edge["attributes"]:
+            attr_pairs = [f'{k}: "{v}"' if isinstance(v, str) else f'{k}: {v}' for k, v in edge["attributes"].items()]
+            attr_str = " { " + ", ".join(attr_pairs) + " }"
+
+        cypher_edges.append(
+            f'''
 MATCH (a {{id: "{src}"}}), (b {{id: "{tgt}"}})
 CREATE (a)-[:{rel}{attr_str}]->(b);
 '''
-    )
+        )
+
+    # Write Cypher script to file
+    with open(output, "w", encoding="utf-8") as f:
+        f.write("\n".join(cypher_nodes + cypher_edges))
 
-# Write Cypher script to file
-with open(output, "w", encoding="utf-8") as f:
-    f.write("\n".join(cypher_nodes + cypher_edges))
\ No newline at end of file
+# run_pipeline imports the helpers above; only convert when run as a script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Document reading shared by ``pipeline`` and ``doc_tree``.
+
+Importing this module has no side effects (no environment changes, spaCy
+pipelines or database drivers), so lightweight entry points can use it
+without pulling in ``doc_tree``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pdfplumber
+
+from kg_utils import _dumps, _loads, _write_atomic
+
+# Sentence spans per document, keyed by content hash; empty string disables
+SPANS_CACHE_DIR = os.environ.get(
+    "SPANS_CACHE_DIR", str(Path.home() / ".cache" / "clearsure" / "spans")
+)
+
+# PDFs with more pages than this are extracted in a process pool
+PARALLEL_PDF_MIN_PAGES = 8
+
+
+def _page_text(page) -> str:
+    """Return the text of a pdfplumber *page* and free its parsed objects."""
+    try:
+        return page.extract_text() or ""
+    finally:
+        # otherwise every page's layout stays cached until the PDF is closed
+        page.close()
+
+
+def _extract_page_range(path: Path, start: int, stop: int) -> str:
+    """Return the text of pages ``start``..``stop - 1`` (runs in a worker)."""
+    with pdfplumber.open(path) as pdf:
+        return "\n".join(_page_text(pdf.pages[i]) for i in range(start, stop))
+
+
+def extract_text(path: Path) -> str:
+    """Return plain text from *path*.
+
+    Supports PDF via ``pdfplumber`` or reads the file as UTF-8 text otherwise.
+    Long PDFs are split into contiguous page ranges extracted in parallel
+    processes, since layout analysis is CPU-bound.
+    Text files are read with ``read_utf8``.
+    """
+    if path.suffix.lower() == ".pdf":
+        with pdfplumber.open(path) as pdf:
+            n_pages = len(pdf.pages)
+            if n_pages <= PARALLEL_PDF_MIN_PAGES:
+                return "\n".join(_page_text(page) for page in pdf.pages)
+
+        workers = min(os.cpu_count() or 1, n_pages)
+        step = -(-n_pages // workers)  # ceil division
+        starts = range(0, n_pages, step)
+        stops = [min(start + step, n_pages) for start in starts]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = pool.map(_extract_page_range, [path] * len(starts), starts, stops)
+            return "\n".join(chunks)
+
+    return read_utf8(path)
+
+
+def read_utf8(path: Path) -> str:
+    """Return the UTF-8 text of *path* with newlines normalised to ``\n``.
+
+    The file is decoded straight from a read-only memory map so the raw bytes
+    never sit on the heap next to the decoded string. ``\r\n`` and ``\r``
+    are translated as ``Path.read_text`` does, and a BOM is kept, so
+    character offsets match those of a plain ``read_text``.
+    """
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""  # mmap refuses empty files
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, "utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def sentence_spans(text: str, nlp) -> list[tuple[int, int]]:
+    """Return whitespace-trimmed ``(start, end)`` sentence spans of *text*.
+
+    ``end`` is exclusive. *nlp* is any spaCy pipeline that sets sentence
+    boundaries; its ``max_length`` is raised when *text* would exceed it.
+    """
+    if len(text) >= nlp.max_length:
+        nlp.max_length = len(text) + 1
+    spans: list[tuple[int, int]] = []
+    for sent in nlp(text).sents:
+        raw = sent.text
+        stripped = raw.strip()
+        if not stripped:
+            continue
+        start = sent.start_char + len(raw) - len(raw.lstrip())
+        spans.append((start, start + len(stripped)))
+    return spans
+
+
+def document_spans(text: str, nlp, inclusive: bool = False) -> list[tuple[int, int]]:
+    """Return ``sentence_spans(text, nlp)``, cached on disk.
+
+    The key covers spaCy's version and *nlp*'s model, version and components
+    as well as *text*, so a different splitter never reuses these spans. The
+    cache always stores exclusive ends; with *inclusive* the returned ``end``
+    is the index of the sentence's last character instead.
+    """
+    if not SPANS_CACHE_DIR:
+        spans = sentence_spans(text, nlp)
+    else:
+        import spacy
+
+        meta = nlp.meta
+        splitter = (
+            f"spacy-{spacy.__version__}:{meta['lang']}_{meta['name']}-{meta['version']}"
+            f":{','.join(nlp.pipe_names)}"
+        )
+        h = hashlib.blake2b(digest_size=16)
+        h.update(splitter.encode("utf-8") + b"\0")
+        h.update(text.encode("utf-8"))
+        cache = Path(SPANS_CACHE_DIR) / f"sentences-{h.hexdigest()}.json"
+        if cache.exists():
+            spans = [tuple(span) for span in _loads(cache.read_bytes())]
+        else:
+            spans = sentence_spans(text, nlp)
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            # a torn file would fail to decode on every later run of the document
+            _write_atomic(cache, _dumps(spans, indent=None))
+    if inclusive:
+        return [(start, end - 1) for start, end in spans]
+    return spans
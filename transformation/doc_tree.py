@@ -4,12 +4,14 @@
 from __future__ import annotations
 
 import argparse
-import json
 import os
+import re
+import secrets
+from collections import deque
 from dataclasses import dataclass, field
 from pathlib import Path
+from types import MappingProxyType
 from typing import List
-from uuid import uuid4
 
 try:
     # load environment variables from .env file (requires `python-dotenv`)
@@ -23,13 +25,18 @@ os.environ["OLLAMA_HOST"] = os.environ.get(
     "OLLAMA_HOST_PC", os.environ.get("OLLAMA_HOST", "")
 )
 
-import nltk
-import pdfplumber
+import spacy
 from neo4j import GraphDatabase
 from langchain_ollama.llms import OllamaLLM
-from LLMs import label_text, sentence_topic_same, clean_label
+from doc_io import document_spans, extract_text, read_utf8
+from kg_utils import _dumps
+from LLMs import label_text, sentence_topic_same_many, find_first_off_topic, clean_label
 
 VERBOSE = False
+# Number of sentences judged per "find the topic shift" prompt
+TOPIC_WINDOW = 32
+# Concurrent per-sentence checks when the batched reply can't be parsed
+TOPIC_CONCURRENCY = 8
 
 
 def log(msg: str) -> None:
@@ -41,55 +48,60 @@ def log(msg: str) -> None:
 # Helpers
 # ---------------------------------------------------------------------------
 
-def get_context_window(model) -> int:
-    known = {
+_CONTEXT_WINDOWS = MappingProxyType(
+    {
         "gpt-3.5-turbo": 16384,
         "gpt-4": 8192,
         "gpt-4-turbo": 128000,
+        "deepseek-r1:14b": 8192,
     }
-    if isinstance(model, str):
-        key = model
-    else:
-        key = getattr(model, "model", "")
-    return known.get(key, 8192)
-
-
-def extract_text(path: Path) -> str:
-    """Return plain text from *path*.
-
-    Supports PDF via ``pdfplumber`` or reads the file as UTF-8 text otherwise.
-    """
-    if path.suffix.lower() == ".pdf":
-        with pdfplumber.open(path) as pdf:
-            pages = [page.extract_text() or "" for page in pdf.pages]
-        return "\n".join(pages)
+)
 
-    return path.read_text(encoding="utf-8")
 
+def get_context_window(model) -> int:
+    # an explicit Ollama num_ctx is the window the server actually uses
+    num_ctx = getattr(model, "num_ctx", None)
+    if num_ctx:
+        return num_ctx
+    key = model if isinstance(model, str) else getattr(model, "model", "")
+    return _CONTEXT_WINDOWS.get(key, 8192)
 
 
 # ---------------------------------------------------------------------------
 # Node class
 # ---------------------------------------------------------------------------
 
-@dataclass
+@dataclass(slots=True)
 class Node:
     name: str
     char_start: int
     char_end: int
     parent: str | None = None
-    id: str = field(default_factory=lambda: str(uuid4()))
+    # 72 random bits in 12 URL-safe chars instead of a 36-char UUID string
+    id: str = field(default_factory=lambda: secrets.token_urlsafe(9))
     children: List["Node"] = field(default_factory=list)
 
-    def to_dict(self) -> dict:
+    def _shallow_dict(self) -> dict:
         return {
             "id": self.id,
             "name": self.name,
             "char_start": self.char_start,
             "char_end": self.char_end,
-            "children": [c.to_dict() for c in self.children],
+            "children": [],
         }
 
+    def to_dict(self) -> dict:
+        """Return the subtree as nested dicts, walking it with an explicit stack."""
+        out = self._shallow_dict()
+        stack = [(self, out)]
+        while stack:
+            node, node_dict = stack.pop()
+            for child in node.children:
+                child_dict = child._shallow_dict()
+                node_dict["children"].append(child_dict)
+                stack.append((child, child_dict))
+        return out
+
 
 def flatten_tree(root: "Node") -> tuple[list[dict], list[dict]]:
     """Return all topic nodes and HAS_CHILD edges from ``root``.
@@ -100,7 +112,16 @@ def flatten_tree(root: "Node") -> tuple[list[dict], list[dict]]:
     nodes: list[dict] = []
     edges: list[dict] = []
 
-    def _walk(node: Node) -> None:
+    # explicit stack in pre-order (children pushed reversed), so deep trees
+    # can't hit the recursion limit; each HAS_CHILD edge is emitted just
+    # before its child's subtree, as a recursive walk would
+    stack: list[tuple[Node, str | None]] = [(root, None)]
+    while stack:
+        node, parent_id = stack.pop()
+        if parent_id is not None:
+            edges.append(
+                {"source": parent_id, "relation": "HAS_CHILD", "target": node.id}
+            )
         nodes.append(
             {
                 "id": node.id,
@@ -110,13 +131,7 @@ def flatten_tree(root: "Node") -> tuple[list[dict], list[dict]]:
                 "char_end": node.char_end,
             }
         )
-        for child in node.children:
-            edges.append(
-                {"source": node.id, "relation": "HAS_CHILD", "target": child.id}
-            )
-            _walk(child)
-
-    _walk(root)
+        stack.extend((child, node.id) for child in reversed(node.children))
     return nodes, edges
 
 
@@ -124,11 +139,18 @@ def flatten_tree(root: "Node") -> tuple[list[dict], list[dict]]:
 # Topic discovery
 # ---------------------------------------------------------------------------
 
-TOKENIZER = nltk.data.load("tokenizers/punkt/english.pickle")
+# A blank pipeline with the rule-based sentencizer only needs the tokenizer,
+# so it avoids both the Punkt download and a statistical parser pass.
+_NLP = spacy.blank("en")
+_NLP.add_pipe("sentencizer")
 
 
 def _ensure_length(text: str, limit: int) -> str:
-    tokens = text.split()
+    # a text can't hold more whitespace-separated tokens than characters
+    if len(text) <= limit:
+        return text
+    # stop splitting after `limit` tokens; the remainder lands in one item
+    tokens = text.split(None, limit)
     if len(tokens) <= limit:
         return text
     return " ".join(tokens[:limit])
@@ -136,47 +158,107 @@ def _ensure_length(text: str, limit: int) -> str:
 
 
 
+# Bullets, citation markers and figure/table captions never start a topic. A
+# caption's number is followed by ":", "." or a dash, so prose such as
+# "Table 2 shows that ..." is still checked.
+_TRIVIAL_RE = re.compile(
+    r"^[\W\d]+$"
+    r"|^(?:fig(?:ure)?|table|eq)\.?\s*\d+(?:\.\d+)*[a-z]?\s*[:.\u2013\u2014-](?:\s|$)",
+    re.I,
+)
+TRIVIAL_MAX_TOKENS = 3
+
+
+def _is_trivial(sentence: str) -> bool:
+    """True for sentences too short or structural to be worth an LLM check."""
+    if len(sentence.split(None, TRIVIAL_MAX_TOKENS)) <= TRIVIAL_MAX_TOKENS:
+        return True
+    return _TRIVIAL_RE.match(sentence) is not None
+
+
+def _first_off_topic(label: str, sents: list[str], model) -> int:
+    """Index of the first sentence in *sents* that leaves *label*, or -1."""
+    idx = find_first_off_topic(label, sents, model)
+    if idx is not None:
+        return idx
+    verdicts = sentence_topic_same_many(label, sents, model, TOPIC_CONCURRENCY)
+    return next((k for k, same in enumerate(verdicts) if not same), -1)
+
+
+def _topic_window(
+    text: str, spans: list[tuple[int, int]], i: int, ctx_limit: int
+) -> tuple[list[tuple[int, int]], list[str]]:
+    """Return up to ``TOPIC_WINDOW`` spans from ``spans[i]`` and their text.
+
+    The window closes early once its sentences would exceed *ctx_limit*
+    characters in total, so the single prompt they share stays inside the
+    context window; the first sentence is always included.
+    """
+    window: list[tuple[int, int]] = []
+    sents: list[str] = []
+    size = 0
+    for s, e in spans[i : i + TOPIC_WINDOW]:
+        sent = _ensure_length(text[s:e], ctx_limit)
+        if sents and size + len(sent) > ctx_limit:
+            break
+        window.append((s, e))
+        sents.append(sent)
+        size += len(sent)
+    return window, sents
+
+
 def phase2(
     text: str,
+    spans: list[tuple[int, int]],
+    i0: int,
     parent: Node,
-    offset: int,
     model,
     ctx_limit: int,
 ) -> None:
-    spans = list(TOKENIZER.span_tokenize(text))
-    if not spans:
-        return
-    first_start, first_end = spans[0]
-    first_sentence = text[first_start:first_end]
-    raw_label = label_text(_ensure_length(first_sentence, ctx_limit), model)
-    if "<think>" in raw_label and VERBOSE:
-        print(raw_label)
-    label = clean_label(raw_label)
-    end = first_end
-    for i in range(1, len(spans)):
-        sent = text[spans[i][0] : spans[i][1]]
-        sent_trunc = _ensure_length(sent, ctx_limit)
-        if sentence_topic_same(label, sent_trunc, model):
-            end = spans[i][1]
-        else:
-            node = Node(
-                name=label,
-                char_start=offset + first_start,
-                char_end=offset + end - 1,
-                parent=parent.id,
-            )
-            log(f"🪧 New node: {label} [{node.char_start}-{node.char_end}]")
-            parent.children.append(node)
-            phase2(text[end:], parent, offset + end, model, ctx_limit)
-            return
-    node = Node(
-        name=label,
-        char_start=offset + first_start,
-        char_end=offset + spans[-1][1] - 1,
-        parent=parent.id,
-    )
-    log(f"🪧 New node: {label} [{node.char_start}-{node.char_end}]")
-    parent.children.append(node)
+    """Attach topic nodes for ``spans[i0:]`` of *text* to *parent*.
+
+    *spans* are the sentence spans of the whole document, computed once by
+    the caller, so splitting never re-tokenizes the remaining text.
+    """
+    skipped = 0
+    while i0 < len(spans):
+        first_start, first_end = spans[i0]
+        first_sentence = text[first_start:first_end]
+        raw_label = label_text(_ensure_length(first_sentence, ctx_limit), model)
+        if "<think>" in raw_label and VERBOSE:
+            print(raw_label)
+        label = clean_label(raw_label)
+        end = first_end
+        next_i0 = len(spans)
+        i = i0 + 1
+        while i < len(spans):
+            window, sents = _topic_window(text, spans, i, ctx_limit)
+            # trivial sentences are assumed to stay on the current topic
+            checked = [j for j, sent in enumerate(sents) if not _is_trivial(sent)]
+            skipped += len(sents) - len(checked)
+            k = -1
+            if checked:
+                off = _first_off_topic(label, [sents[j] for j in checked], model)
+                if off != -1:
+                    k = checked[off]
+            if k == -1:
+                end = window[-1][1]
+                i += len(window)
+                continue
+            if k > 0:
+                end = window[k - 1][1]
+            next_i0 = i + k
+            break
+        node = Node(
+            name=label,
+            char_start=first_start,
+            char_end=end - 1,
+            parent=parent.id,
+        )
+        log(f"🪧 New node: {label} [{node.char_start}-{node.char_end}]")
+        parent.children.append(node)
+        i0 = next_i0
+    log(f"⏭️  Skipped topic checks for {skipped} trivial sentences")
 
 
 def build_tree(text: str, model) -> Node:
@@ -188,7 +270,7 @@ def build_tree(text: str, model) -> Node:
     root_name = clean_label(raw_root)
     log(f"🌲 Root topic: {root_name}")
     root = Node(name=root_name, char_start=0, char_end=len(text) - 1, parent=None)
-    phase2(text, root, 0, model, ctx // 2)
+    phase2(text, document_spans(text, _NLP), 0, root, model, ctx // 2)
     return root
 
 
@@ -198,32 +280,61 @@ def build_tree(text: str, model) -> Node:
 
 
 
-def push_to_neo4j(root: Node, uri: str, user: str, password: str) -> None:
+NEO4J_BATCH_SIZE = 5000
+
+
+def _tree_rows(root: Node) -> tuple[list[dict], list[dict]]:
+    """Return Topic node rows and HAS_CHILD edge rows for ``root`` in BFS order."""
+    nodes: list[dict] = []
+    edges: list[dict] = []
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        nodes.append(
+            {"id": node.id, "name": node.name, "cs": node.char_start, "ce": node.char_end}
+        )
+        for child in node.children:
+            edges.append({"pid": node.id, "cid": child.id})
+            queue.append(child)
+    return nodes, edges
+
+
+def push_to_neo4j(
+    root: Node, uri: str, user: str, password: str, idempotent: bool = False
+) -> None:
+    """Upsert the topic tree with batched ``UNWIND`` queries in one transaction.
+
+    Every (parent, child) pair occurs once in a tree and node ids are fresh
+    per build, so HAS_CHILD edges are plainly ``CREATE``d. Pass
+    ``idempotent=True`` when re-pushing a tree that may already be stored to
+    ``MERGE`` them instead.
+    """
     log(f"🔗 Connecting to Neo4j at {uri}")
+    nodes, edges = _tree_rows(root)
+    edge_write = "MERGE" if idempotent else "CREATE"
     driver = GraphDatabase.driver(uri, auth=(user, password))
     with driver.session() as session:
-        def _create(node: Node, parent_id: str | None):
-            log(f"➡️  Pushing node '{node.name}' ({node.id})")
-            session.run(
-                "MERGE (n:Topic {id:$id}) SET n.name=$name, n.char_start=$cs, n.char_end=$ce",
-                id=node.id,
-                name=node.name,
-                cs=node.char_start,
-                ce=node.char_end,
-            )
-            if parent_id:
-                session.run(
-                    "MATCH (p:Topic {id:$pid}),(c:Topic {id:$cid}) "
-                    "MERGE (p)-[:HAS_CHILD]->(c)",
-                    pid=parent_id,
-                    cid=node.id,
+        session.run(
+            "CREATE CONSTRAINT topic_id IF NOT EXISTS FOR (t:Topic) REQUIRE t.id IS UNIQUE"
+        )
+        with session.begin_transaction() as tx:
+            for i in range(0, len(nodes), NEO4J_BATCH_SIZE):
+                tx.run(
+                    "UNWIND $rows AS r MERGE (n:Topic {id:r.id}) "
+                    "SET n.name=r.name, n.char_start=r.cs, n.char_end=r.ce",
+                    rows=nodes[i : i + NEO4J_BATCH_SIZE],
                 )
-            for child in node.children:
-                _create(child, node.id)
-
-        _create(root, None)
+            for i in range(0, len(edges), NEO4J_BATCH_SIZE):
+                tx.run(
+                    "UNWIND $rows AS r "
+                    "MATCH (c:Topic {id:r.cid}) WITH r, c "
+                    "MATCH (p:Topic {id:r.pid}) "
+                    f"{edge_write} (p)-[:HAS_CHILD]->(c)",
+                    rows=edges[i : i + NEO4J_BATCH_SIZE],
+                )
+            tx.commit()
     driver.close()
-    log("✅ Finished pushing to Neo4j")
+    log(f"✅ Finished pushing {len(nodes)} topics to Neo4j")
 
 
 def clear_neo4j(uri: str, user: str, password: str, drop_meta: bool = False) -> None:
@@ -269,6 +380,11 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Clear Neo4j database before inserting topics",
     )
+    p.add_argument(
+        "--idempotent",
+        action="store_true",
+        help="MERGE topic edges so re-pushing an existing tree adds no duplicates",
+    )
     p.add_argument("--verbose", action="store_true", help="Print progress")
     return p.parse_args()
 
@@ -280,22 +396,19 @@ def main() -> None:
     model = OllamaLLM(
         model=args.model,
         base_url=os.environ["OLLAMA_HOST"],
-        options={"num_ctx": 8192},
+        num_ctx=8192,
         temperature=0.0,
     )
-    try:
-        nltk.data.find("tokenizers/punkt")
-    except LookupError:
-        nltk.download("punkt")
-
     log(f"📄 Reading {args.input}")
     text = extract_text(Path(args.input))
     tree = build_tree(text, model)
     log(f"💾 Writing tree to {args.out}")
-    Path(args.out).write_text(json.dumps(tree.to_dict(), indent=2), encoding="utf-8")
+    Path(args.out).write_bytes(_dumps(tree.to_dict()))
     if args.reset_db:
         clear_neo4j(args.neo4j_uri, args.neo4j_user, args.neo4j_pass, drop_meta=True)
-    push_to_neo4j(tree, args.neo4j_uri, args.neo4j_user, args.neo4j_pass)
+    push_to_neo4j(
+        tree, args.neo4j_uri, args.neo4j_user, args.neo4j_pass, idempotent=args.idempotent
+    )
 
 
 if __name__ == "__main__":
@@ -1,47 +1,98 @@
 # kg_utils.py
 # --- add near the top -------------------------------------------------------
-import json, re, os
+import itertools, json, re, os, stat, tempfile
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Union, Dict, Any, List, Tuple, Optional
-from copy import deepcopy
+from typing import Union, Dict, Any, Iterator, List, Tuple, Optional
+
+try:
+    # orjson is a C extension; fall back to stdlib json when it's missing
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
 
 _EDGE = Tuple[str, str, str]
 
+# Permissions for files _write_atomic creates; an existing file keeps its own
+_NEW_FILE_MODE = 0o644
+
 _FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.I)
 _ID_PREFIX_RE = re.compile(r"^([nswrt])(\d+)$")
-_EDGE_ID_RE = re.compile(r"^e(\d+)$")
 _BRACKET_REF_RE = re.compile(r"\[(n\d+|s\d+|w\d+|r\d+|t\d+)\]")
+_JSON_DECODER = json.JSONDecoder()
+
+# Prebuilt "n0".."n4095", "e0".."e4095", ... so the common small IDs are a
+# list lookup rather than a fresh string each time
+_ID_CACHE_SIZE = 4096
+_ID_CACHE = {p: [p + str(i) for i in range(_ID_CACHE_SIZE)] for p in "nswrte"}
+
+
+def _make_id(prefix: str, idx: int) -> str:
+    """Return the ID ``f"{prefix}{idx}"``, from the prebuilt table if possible."""
+    if idx < _ID_CACHE_SIZE and prefix in _ID_CACHE:
+        return _ID_CACHE[prefix][idx]
+    return prefix + str(idx)
 
 
 def _strip_fence(text: str) -> str:
     """Remove ```json fences and surrounding blank lines."""
+    if "```" not in text:  # common case: skip the regex engine entirely
+        return text.strip()
     return _FENCE_RE.sub("", text).strip()
 
 
-# Helpers ────────────────────────────────────────────────────────────────────────
-_BRACE_RE = re.compile(r"\{.*\}", re.S)
+def _loads(data: Union[str, bytes]) -> Any:
+    """Decode JSON *data* with orjson when available, else stdlib json.
 
+    Both raise a ``ValueError`` subclass on malformed input.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
-def _extract_json_block(text: str) -> str:
+
+def _dumps(obj: Any, indent: Optional[int] = 2) -> bytes:
+    """Encode *obj* as UTF-8 JSON bytes, using orjson when available.
+
+    orjson only knows two-space indentation, so other *indent* values go
+    through stdlib json.
     """
-    Return the first well-balanced {...} block in *text*.
-    Raises ValueError if none is found or braces are unbalanced.
+    if orjson is not None and indent in (None, 2):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=indent, ensure_ascii=False).encode("utf-8")
+
+
+def _dumps_line(obj: Any) -> bytes:
+    """Encode *obj* as one compact, newline-terminated JSON line."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+# Helpers ────────────────────────────────────────────────────────────────────────
+def _parse_llm_json(text: str) -> Any:
+    """Decode the JSON object in an LLM reply.
+
+    Bare JSON (the usual case in JSON mode) is decoded in one call. Otherwise
+    ``` fences are stripped and the first ``{...}`` is decoded in place;
+    ``raw_decode`` finds its end in C and ignores any trailing chatter.
+    Always returns a dict; other top-level values (arrays, strings) fall
+    through to the ``{`` search. Raises ``ValueError`` if there is no
+    decodable object.
     """
+    try:
+        obj = _loads(text)
+    except ValueError:
+        pass
+    else:
+        if isinstance(obj, dict):
+            return obj
     text = _strip_fence(text)
     start = text.find("{")
     if start == -1:
         raise ValueError("No opening '{' found in patch string.", text)
-
-    depth = 0
-    for i, ch in enumerate(text[start:], start=start):
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                return text[start : i + 1]
-
-    raise ValueError("Unbalanced braces in patch string.")
+    obj, _ = _JSON_DECODER.raw_decode(text, start)
+    return obj
 
 
 def _rewrite_bracket_refs(text: str, id_map: dict[str, str]) -> str:
@@ -49,43 +100,58 @@ def _rewrite_bracket_refs(text: str, id_map: dict[str, str]) -> str:
     Replace every [s1]/[n3]/[w4] in *text* with the *new* ID
     according to *id_map*.
     """
+    if "[" not in text:  # most labels carry no references at all
+        return text
+
+    get = id_map.get
 
     def _repl(m):
         old = m.group(1)
-        return f"[{id_map.get(old, old)}]"
+        return f"[{get(old, old)}]"
 
     return _BRACKET_REF_RE.sub(_repl, text)
 
 
-def _load_patch(
-    patch: Union[str, Dict[str, Any]], objectType="edges_patch"
-) -> List[Dict[str, Any]]:
+def _load_patch_dict(patch: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
     """
     Accepts …
       • dict                      -> returns it directly
       • path-like str             -> reads the file
-      • objectType                -> what we want to merge
       • raw JSON string (with / without ``` fences, with / without chatter)
 
-    Returns list[edge] from the `objectType` key.
+    Returns the whole decoded patch object.
     """
     if isinstance(patch, dict):
-        return patch.get(objectType, [])
-
-    # Treat as file path if it exists
-    p = Path(patch)
-    patch_str = p.read_text(encoding="utf-8") if p.exists() else patch
+        return patch
+
+    # Treat as file path if it exists; inline JSON never is one (and may be
+    # longer than the OS allows for a file name)
+    patch_str = patch
+    if not patch.lstrip().startswith(("{", "`")):
+        try:
+            p = Path(patch)
+            if p.exists():
+                data = p.read_bytes()
+                try:
+                    # a plain JSON file parses straight from bytes
+                    return _loads(data)
+                except ValueError:
+                    patch_str = data.decode("utf-8")
+        except OSError:
+            pass
+
+    return _parse_llm_json(patch_str)
 
-    patch_str = _strip_fence(patch_str)
 
-    # ① try straight JSON
-    try:
-        obj = json.loads(patch_str)
-    except json.JSONDecodeError:
-        # ② fall back to extracting the first {...} block
-        obj = json.loads(_extract_json_block(patch_str))
+def _load_patch(
+    patch: Union[str, Dict[str, Any]], objectType="edges_patch"
+) -> List[Dict[str, Any]]:
+    """Return the `objectType` list (e.g. ``edges_patch``/``nodes``) of *patch*.
 
-    return obj.get(objectType, [])
+    Callers needing more than one key should decode once with
+    `_load_patch_dict()` instead.
+    """
+    return _load_patch_dict(patch).get(objectType, [])
 
 
 def _dedupe_edges(edges: list[dict]) -> set[tuple[str, str, str]]:
@@ -98,6 +164,169 @@ def _dedupe_nodes(nodes: list[dict]) -> set[str]:
     return {n["id"] for n in nodes}
 
 
+def _unseen_edges(edges: list[dict], seen: set[_EDGE]) -> list[dict]:
+    """Return the *edges* whose triple is not in *seen*, recording them in *seen*.
+
+    The first of several identical triples wins; input order is kept.
+    """
+    return [
+        e
+        for e in edges
+        if (t := (e["source"], e["relation"], e["target"])) not in seen
+        and not seen.add(t)
+    ]
+
+
+def _unseen_nodes(nodes: list[dict], seen: set[str]) -> list[dict]:
+    """Return the *nodes* whose ID is not in *seen*, recording them in *seen*."""
+    return [n for n in nodes if n["id"] not in seen and not seen.add(n["id"])]
+
+
+_SAVE_MODES = ("rewrite", "append")
+
+
+def _journal_path(kg_path: Path) -> Path:
+    """Sidecar file holding nodes/edges appended since the last compaction."""
+    return kg_path.with_suffix(".jsonl")
+
+
+def _read_kg(kg_path: Path) -> Dict[str, Any]:
+    """Load the KG at *kg_path* and replay its append journal, if any."""
+    kg = _loads(kg_path.read_bytes())
+    journal = _journal_path(kg_path)
+    if journal.exists():
+        with journal.open("rb") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                rec = _loads(line)
+                if "node" in rec:
+                    kg["nodes"].append(rec["node"])
+                else:
+                    kg["edges"].append(rec["edge"])
+    return kg
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Write *data* to a temp file beside *path*, then rename it into place.
+
+    Readers never see a half-written KG, even if the process dies mid-write.
+    The file keeps the permissions of the one it replaces, or gets
+    ``_NEW_FILE_MODE`` when new; mkstemp alone would leave it at 0600.
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = _NEW_FILE_MODE
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _save_kg(
+    kg_path: Path,
+    kg: Dict[str, Any],
+    added_nodes: list[dict],
+    added_edges: list[dict],
+    indent: int,
+    mode: str,
+) -> None:
+    """Persist a merge: append the new items to the journal or rewrite the file."""
+    if not (added_nodes or added_edges):
+        return  # nothing new -> the file on disk is already up to date
+    if mode == "append":
+        with _journal_path(kg_path).open("ab") as fh:
+            fh.writelines(_dumps_line({"node": n}) for n in added_nodes)
+            fh.writelines(_dumps_line({"edge": e}) for e in added_edges)
+    else:
+        _write_atomic(kg_path, _dumps(kg, indent))
+        # the journal is now part of the file
+        _journal_path(kg_path).unlink(missing_ok=True)
+
+
+def compact_kg(
+    kg_path: str | os.PathLike = "final_kg.json", indent: int = 2
+) -> Dict[str, Any]:
+    """
+    Fold the append journal written by ``mode="append"`` back into *kg_path*.
+
+    Returns the full KG dict.
+    """
+    kg_path = Path(kg_path)
+    kg = _read_kg(kg_path)
+    journal = _journal_path(kg_path)
+    if journal.exists():
+        _write_atomic(kg_path, _dumps(kg, indent))
+        journal.unlink()
+    return kg
+
+
+class KG:
+    """A KG dict plus the indexes `clean_kg`/`update_kg` need to merge into it.
+
+    Building the indexes is O(N). Keeping one ``KG`` across many merges
+    (pass it as ``graph=``) makes each merge O(patch) instead. While it is
+    in use, only mutate ``data`` through those functions.
+    """
+
+    __slots__ = ("data", "node_ids", "edge_keys", "node_max", "edge_max")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.node_ids = _dedupe_nodes(data["nodes"])
+        self.edge_keys = _dedupe_edges(data["edges"])
+        self.node_max = _max_indices(data["nodes"])
+        self.edge_max = _max_edge_index(data["edges"])
+
+    @classmethod
+    def load(cls, kg_path: str | os.PathLike = "final_kg.json") -> "KG":
+        """Read *kg_path* (and its append journal) and index it."""
+        return cls(_read_kg(Path(kg_path)))
+
+    def _track(self, added_nodes: list[dict], added_edges: list[dict]) -> None:
+        """Raise the stored ID maxima past freshly appended nodes/edges."""
+        if added_nodes:
+            for prefix, idx in _max_indices(added_nodes).items():
+                if idx > self.node_max[prefix]:
+                    self.node_max[prefix] = idx
+        if added_edges:
+            self.edge_max = max(self.edge_max, _max_edge_index(added_edges))
+
+    def add_nodes(self, nodes: list[dict]) -> list[dict]:
+        """Append the *nodes* whose ID is new; return the ones appended."""
+        added = _unseen_nodes(nodes, self.node_ids)
+        self.data["nodes"].extend(added)
+        self._track(added, [])
+        return added
+
+    def add_edges(self, edges: list[dict]) -> list[dict]:
+        """Append the *edges* whose triple is new; return the ones appended."""
+        added = _unseen_edges(edges, self.edge_keys)
+        self.data["edges"].extend(added)
+        self._track([], added)
+        return added
+
+    def replace_edges(self, edges: list[dict]) -> None:
+        """Make *edges* the graph's edge list and re-index them."""
+        self.data["edges"] = edges
+        self.edge_keys = _dedupe_edges(edges)
+        self.edge_max = _max_edge_index(edges)
+
+    def apply_patch(self, patch: Union[str, Dict[str, Any]], **kwargs):
+        """`update_kg` into this graph in memory; nothing is written."""
+        return update_kg(patch, save=False, graph=self, **kwargs)
+
+    def apply_edges(self, patch: Union[str, Dict[str, Any]], **kwargs):
+        """`clean_kg` into this graph in memory; nothing is written."""
+        return clean_kg(patch, save=False, graph=self, **kwargs)
+
+
 def clean_kg(
     patch: Union[str, Dict[str, Any]],
     kg_path: str | os.PathLike = "final_kg.json",
@@ -107,6 +336,8 @@ def clean_kg(
     id_map: Optional[Dict[str, str]] = None,
     reassign_edge_ids: bool = True,
     drop_missing: bool = True,
+    mode: str = "rewrite",
+    graph: Optional[KG] = None,
 ) -> Dict[str, Any]:
     """
     Merge an *edges_patch* (and optional ``nodes`` list) into the KG at
@@ -124,24 +355,36 @@ def clean_kg(
         If True, give each incoming edge a fresh sequential edgeId.
     drop_missing
         If True, skip edges whose mapped endpoints are not present in the KG.
+    mode
+        ``"rewrite"`` writes the whole KG back to *kg_path*. ``"append"`` only
+        appends the new nodes/edges to a ``.jsonl`` journal next to it; call
+        `compact_kg()` to fold the journal back into *kg_path*.
+    graph
+        An already loaded `KG` for *kg_path* to merge into instead of reading
+        the file again; it is updated in place.
 
     Returns the updated KG dict.
     """
+    if mode not in _SAVE_MODES:
+        raise ValueError(f"mode must be one of {_SAVE_MODES}, got {mode!r}")
     kg_path = Path(kg_path)
-    kg = json.loads(kg_path.read_text(encoding="utf-8"))
-    node_ids = {n["id"] for n in kg["nodes"]}
 
-    new_edges = deepcopy(_load_patch(patch))  # defensive copy
-    new_nodes = deepcopy(_load_patch(patch, "nodes"))
+    # defensive copies; only top-level keys (source/target/edgeId) are mutated
+    patch_obj = _load_patch_dict(patch)
+    new_edges = [dict(e) for e in patch_obj.get("edges_patch", [])]
+    new_nodes = [dict(n) for n in patch_obj.get("nodes", [])]
+
+    # Empty patch: nothing to index, merge or write
+    if not new_edges and not new_nodes:
+        return graph.data if graph is not None else _read_kg(kg_path)
+
+    if graph is None:
+        graph = KG.load(kg_path)
+    kg = graph.data
+    node_ids = graph.node_ids
 
     # Deduplicate and append nodes first so edges don't get dropped
-    if new_nodes:
-        seen_nodes = _dedupe_nodes(kg["nodes"])
-        for n in new_nodes:
-            if n["id"] not in seen_nodes:
-                kg["nodes"].append(n)
-                node_ids.add(n["id"])
-                seen_nodes.add(n["id"])
+    added_nodes = graph.add_nodes(new_nodes)
 
     # Rewrite source/target using id_map (if provided)
     if id_map:
@@ -151,7 +394,7 @@ def clean_kg(
 
     # Reassign edgeIds
     if reassign_edge_ids:
-        counter = [_max_edge_index(kg["edges"])]
+        counter = itertools.count(graph.edge_max + 1)
         for e in new_edges:
             e["edgeId"] = _next_edge_id(counter)
 
@@ -162,15 +405,10 @@ def clean_kg(
         ]
 
     # Deduplicate + append
-    seen = _dedupe_edges(kg["edges"])
-    for e in new_edges:
-        triple = (e["source"], e["relation"], e["target"])
-        if triple not in seen:
-            kg["edges"].append(e)
-            seen.add(triple)
+    added_edges = graph.add_edges(new_edges)
 
     if save:
-        kg_path.write_text(json.dumps(kg, indent=indent), encoding="utf-8")
+        _save_kg(kg_path, kg, added_nodes, added_edges, indent, mode)
     return kg
 
 
@@ -181,6 +419,8 @@ def update_kg(
     indent: int = 2,
     *,
     return_id_map: bool = False,
+    mode: str = "rewrite",
+    graph: Optional[KG] = None,
 ):
     """
     Merge *new_kg* (nodes + raw edges) into the KG at *kg_path*.
@@ -189,90 +429,127 @@ def update_kg(
     Also rewrites bracket refs in node labels.
 
     If `return_id_map=True`, returns (kg, id_map); else just kg.
+    `mode` and `graph` are handled as in `clean_kg()`.
     """
+    if mode not in _SAVE_MODES:
+        raise ValueError(f"mode must be one of {_SAVE_MODES}, got {mode!r}")
     kg_path = Path(kg_path)
-    kg = json.loads(kg_path.read_text(encoding="utf-8"))
 
-    patch_nodes = _load_patch(new_kg, "nodes")
-    patch_edges = _load_patch(new_kg, "edges")
+    patch_obj = _load_patch_dict(new_kg)
+    patch_nodes = patch_obj.get("nodes", [])
+    patch_edges = patch_obj.get("edges", [])
+
+    # Empty patch: nothing to index, merge or write
+    if not patch_nodes and not patch_edges:
+        kg = graph.data if graph is not None else _read_kg(kg_path)
+        return (kg, {}) if return_id_map else kg
+
+    if graph is None:
+        graph = KG.load(kg_path)
+    kg = graph.data
 
-    node_counters = {p: _max_index(kg["nodes"], p) for p in ("n", "s", "w", "r", "t")}
-    edge_counter = [_max_edge_index(kg["edges"])]
+    node_counters = dict(graph.node_max)
+    edge_counter = itertools.count(graph.edge_max + 1)
 
     id_map: Dict[str, str] = {}
+    match_id = _ID_PREFIX_RE.match  # bound once, not looked up per node
     for node in patch_nodes:
-        m = _ID_PREFIX_RE.match(node["id"])
+        m = match_id(node["id"])
         if m:
             prefix = m.group(1)
             node_counters[prefix] += 1
-            new_id = f"{prefix}{node_counters[prefix]}"
+            new_id = _make_id(prefix, node_counters[prefix])
             id_map[node["id"]] = new_id
             node["id"] = new_id
         else:
             id_map[node["id"]] = node["id"]
 
-    # Fix bracket references in labels
-    for node in patch_nodes:
-        lbl = node.get("label")
-        if isinstance(lbl, str):
-            node["label"] = _rewrite_bracket_refs(lbl, id_map)
+    # The renumbering above must finish first: a label may reference a node
+    # that appears later in the patch.
+    if any(old != new for old, new in id_map.items()):
+        for node in patch_nodes:
+            lbl = node.get("label")
+            if isinstance(lbl, str):
+                node["label"] = _rewrite_bracket_refs(lbl, id_map)
 
     # Rewrite edges + assign new edgeIds
+    get = id_map.get
     for edge in patch_edges:
-        edge["source"] = id_map.get(edge["source"], edge["source"])
-        edge["target"] = id_map.get(edge["target"], edge["target"])
+        edge["source"] = get(edge["source"], edge["source"])
+        edge["target"] = get(edge["target"], edge["target"])
         edge["edgeId"] = _next_edge_id(edge_counter)
 
     # Deduplicate + append
-    seen_nodes = _dedupe_nodes(kg["nodes"])
-    for n in patch_nodes:
-        if n["id"] not in seen_nodes:
-            kg["nodes"].append(n)
-            seen_nodes.add(n["id"])
-
-    seen_edges = _dedupe_edges(kg["edges"])
-    for e in patch_edges:
-        trip = (e["source"], e["relation"], e["target"])
-        if trip not in seen_edges:
-            kg["edges"].append(e)
-            seen_edges.add(trip)
+    added_nodes = graph.add_nodes(patch_nodes)
+    added_edges = graph.add_edges(patch_edges)
 
     if save:
-        kg_path.write_text(json.dumps(kg, indent=indent), encoding="utf-8")
+        _save_kg(kg_path, kg, added_nodes, added_edges, indent, mode)
 
     return (kg, id_map) if return_id_map else kg
 
 
+@contextmanager
+def kg_session(
+    kg_path: str | os.PathLike = "final_kg.json", indent: int = 2
+) -> Iterator[KG]:
+    """
+    Load the KG at *kg_path* once and write it back once.
+
+    Use the yielded `KG`'s ``apply_patch``/``apply_edges`` for the merges in
+    between. On a clean exit the KG (including any append journal) is
+    written atomically to *kg_path*; if the block raises, the file is left
+    untouched.
+    """
+    kg_path = Path(kg_path)
+    graph = KG.load(kg_path)
+    yield graph
+    _write_atomic(kg_path, _dumps(graph.data, indent))
+    _journal_path(kg_path).unlink(missing_ok=True)
+
+
+def _max_indices(nodes: list[dict], prefixes: str = "nswrt") -> dict[str, int]:
+    """Return the highest numeric suffix per ID prefix in one pass over *nodes*.
+
+    Equivalent to matching ``_ID_PREFIX_RE`` on every ID, but uses plain
+    string checks instead of the regex engine.
+    """
+    maxes = dict.fromkeys(prefixes, 0)
+    for n in nodes:
+        nid = n["id"]
+        prefix = nid[:1]
+        if prefix in maxes and nid[1:].isdecimal():
+            idx = int(nid[1:])
+            if idx > maxes[prefix]:
+                maxes[prefix] = idx
+    return maxes
+
+
 def _max_index(nodes: list[dict], prefix: str) -> int:
-    idx = [
-        int(m.group(2))
-        for n in nodes
-        if (m := _ID_PREFIX_RE.match(n["id"])) and m.group(1) == prefix
-    ]
-    return max(idx, default=0)
+    return _max_indices(nodes, prefix)[prefix]
 
 
 def _max_edge_index(edges: list[dict]) -> int:
-    idx = [
-        int(m.group(1))
-        for e in edges
-        if "edgeId" in e
-        if (m := _EDGE_ID_RE.match(e["edgeId"]))
-    ]
-    return max(idx, default=0)
+    best = 0
+    for e in edges:
+        eid = e.get("edgeId")
+        if eid is not None and eid.startswith("e") and eid[1:].isdecimal():
+            idx = int(eid[1:])
+            if idx > best:
+                best = idx
+    return best
 
 
-def _next_edge_id(counter: list[int]) -> str:
-    """counter is a 1-item list so we can mutate it inside a loop."""
-    counter[0] += 1
-    return f"e{counter[0]}"
+def _next_edge_id(counter: Iterator[int]) -> str:
+    """counter is an ``itertools.count`` starting at the next free index."""
+    return _make_id("e", next(counter))
 
 
 def _fresh_id(old_id: str, counters: dict[str, int]) -> str:
     """Given 'n1' etc. return next free 'nX' and increment counter."""
     prefix = old_id[0]
     counters[prefix] += 1
-    return f"{prefix}{counters[prefix]}"
+    return _make_id(prefix, counters[prefix])
 
 
 def merge_duplicate_nodes(kg: Dict[str, Any]) -> Dict[str, Any]:
@@ -291,18 +568,20 @@ def merge_duplicate_nodes(kg: Dict[str, Any]) -> Dict[str, Any]:
             new_nodes.append(node)
     kg["nodes"] = new_nodes
 
-    for edge in kg.get("edges", []):
-        edge["source"] = mapping.get(edge["source"], edge["source"])
-        edge["target"] = mapping.get(edge["target"], edge["target"])
-
+    # Remap endpoints and drop duplicate triples in a single pass
+    get = mapping.get
     seen: set[_EDGE] = set()
-    dedup_edges: List[dict] = []
-    for e in kg.get("edges", []):
-        trip = (e["source"], e["relation"], e["target"])
-        if trip not in seen:
-            dedup_edges.append(e)
-            seen.add(trip)
-    kg["edges"] = dedup_edges
+    kept: List[dict] = []
+    for edge in kg.get("edges", []):
+        src, tgt = edge["source"], edge["target"]
+        if mapping:
+            src = edge["source"] = get(src, src)
+            tgt = edge["target"] = get(tgt, tgt)
+        triple = (src, edge["relation"], tgt)
+        if triple not in seen:
+            seen.add(triple)
+            kept.append(edge)
+    kg["edges"] = kept
     return kg
 
 
@@ -355,7 +634,7 @@ def causal_edges_to_rules(
     return kg
 
 
-def consolidate_rules_to_topics(kg: Dict[str, Any]) -> Dict[str, Any]:
+def consolidate_rules_to_topics(kg: Union[Dict[str, Any], KG]) -> Dict[str, Any]:
     """Connect Rule nodes to their common Topic and remove redundant edges.
 
     If all statements referenced by a Rule belong to the same Topic via
@@ -363,50 +642,110 @@ def consolidate_rules_to_topics(kg: Dict[str, Any]) -> Dict[str, Any]:
     individual ``HAS_STATEMENT`` edges from the Topic to those statements are
     removed.  This keeps the topic tree compact while preserving the logical
     structure between statements and rules.
+
+    Pass a `KG` to keep its edge index in step; the KG dict is returned.
     """
+    graph = kg if isinstance(kg, KG) else None
+    if graph is not None:
+        kg = graph.data
 
-    # Map statement -> list of topic ids
-    stmt_topics: Dict[str, set[str]] = {}
-    for e in kg.get("edges", []):
-        if e.get("relation") == "HAS_STATEMENT":
-            stmt_topics.setdefault(e["target"], set()).add(e["source"])
+    edges = kg.get("edges", [])
 
-    # Collect rule information
-    rule_nodes = {n["id"] for n in kg.get("nodes", []) if n.get("type") == "Rule"}
-    rule_refs: Dict[str, set[str]] = {rid: set() for rid in rule_nodes}
+    # Rule id -> referenced statements, in node order
+    rule_refs: Dict[str, set[str]] = {
+        n["id"]: set() for n in kg.get("nodes", []) if n.get("type") == "Rule"
+    }
+    # Statement id -> topic ids, from HAS_STATEMENT edges
+    stmt_topics: Dict[str, set[str]] = {}
 
-    for e in kg.get("edges", []):
-        if e.get("source") in rule_nodes and e.get("relation") in {
-            "HAS_CONDITION",
-            "HAS_CONCLUSION",
-        }:
+    # One pass over the edges builds both indices
+    for e in edges:
+        rel = e.get("relation")
+        if rel == "HAS_STATEMENT":
+            stmt_topics.setdefault(e["target"], set()).add(e["source"])
+        elif rel in ("HAS_CONDITION", "HAS_CONCLUSION") and e.get("source") in rule_refs:
             rule_refs[e["source"]].add(e["target"])
 
-    # Prepare edge lookup for removals
-    existing_edges = {(e["source"], e["relation"], e["target"]): e for e in kg.get("edges", [])}
-
-    next_edge_idx = _max_edge_index(kg.get("edges", []))
+    next_edge_idx: Optional[int] = None
     new_edges: list[dict] = []
     remove_keys: set[tuple[str, str, str]] = set()
 
     for rid, stmts in rule_refs.items():
         topics: set[str] = set()
         for sid in stmts:
-            topics.update(stmt_topics.get(sid, set()))
+            topics.update(stmt_topics.get(sid, ()))
         if len(topics) == 1:
             topic = next(iter(topics))
+            if next_edge_idx is None:
+                next_edge_idx = _max_edge_index(edges)
             next_edge_idx += 1
             new_edges.append(
-                {"source": topic, "relation": "HAS_STATEMENT", "target": rid, "edgeId": f"e{next_edge_idx}"}
+                {"source": topic, "relation": "HAS_STATEMENT", "target": rid, "edgeId": _make_id("e", next_edge_idx)}
+            )
+            # every statement with a topic has this one, so its edge exists
+            remove_keys.update(
+                (topic, "HAS_STATEMENT", sid) for sid in stmts if sid in stmt_topics
             )
-            for sid in stmts:
-                key = (topic, "HAS_STATEMENT", sid)
-                if key in existing_edges:
-                    remove_keys.add(key)
 
     if remove_keys or new_edges:
-        kg["edges"] = [
-            e for e in kg.get("edges", []) if (e["source"], e["relation"], e["target"]) not in remove_keys
+        kept = [
+            e for e in edges if (e["source"], e["relation"], e["target"]) not in remove_keys
         ] + new_edges
+        if graph is not None:
+            graph.replace_edges(kept)
+        else:
+            kg["edges"] = kept
 
     return kg
+
+
+# the keyword closest to each [wN]: "at least 5 days after [w1]" is AFTER
+_IF_TIME_RE = re.compile(
+    r"\b(BEFORE|AFTER|AT)\b(?:(?!\b(?:BEFORE|AFTER|AT)\b)[^\[\]])*?\[(w\d+)\]", re.I
+)
+_IF_RE = re.compile(r"\s*IF\b", re.I)
+_NESTED_TIME_RE = re.compile(r"\b(after|before)\s*\[(w\d+)\]", re.I)
+_IF_THEN_RE = re.compile(r"^IF\b.*?\[(s\d+)\].*?\bTHEN\b.*?\[(s\d+)\]", re.I | re.S)
+
+
+def infer_patch_edges(patch: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Return the edges the first-pass clean-up adds to a sentence *patch*.
+
+    Deterministic version of the rules in ``LLMs.clean_up_1st_phase``:
+
+    1. ``IF`` statements referencing ``BEFORE/AFTER/AT … [wN]`` get a
+       ``sK -BEFORE/AFTER/AT-> wN`` edge.
+    2. A ``wK`` anchor whose label says ``after/before [wX]`` gets
+       ``wK -AFTER/BEFORE-> wX``.
+    3. A statement ``sK`` of the form ``IF … [sA] … THEN … [sB]`` gets
+       ``sA -ACTOR_IN-> sK`` and ``sB -OBJECT_IN-> sK``.
+
+    Triples already present in the patch's edges are skipped; the result
+    has the ``edges_patch`` shape (no ``edgeId``).
+    """
+    seen = _dedupe_edges(patch.get("edges", []))
+    out: list[dict] = []
+
+    def add(source: str, relation: str, target: str) -> None:
+        key = (source, relation, target)
+        if key not in seen:
+            seen.add(key)
+            out.append({"source": source, "relation": relation, "target": target})
+
+    for n in patch.get("nodes", []):
+        nid = n.get("id", "")
+        label = n.get("label", "")
+        if "[" not in label:
+            continue
+        if n.get("type") == "Statement" and _IF_RE.match(label):
+            for rel, wid in _IF_TIME_RE.findall(label):
+                add(nid, rel.upper(), wid)
+        if nid.startswith("w"):
+            for rel, wid in _NESTED_TIME_RE.findall(label):
+                add(nid, rel.upper(), wid)
+        if nid.startswith("s"):
+            m = _IF_THEN_RE.match(label.lstrip())
+            if m:
+                add(m.group(1), "ACTOR_IN", nid)
+                add(m.group(2), "OBJECT_IN", nid)
+    return out
@@ -1,6 +1,21 @@
 import os
+from functools import lru_cache
 from typing import Any
 
+# Idle connections kept open to the Ollama server; enough for the pipeline's
+# concurrent _batch requests to reuse sockets instead of reconnecting
+OLLAMA_KEEPALIVE_CONNECTIONS = 32
+
+# Context window requested from Ollama. The server sizes each request's KV
+# cache from it, so lower it (e.g. 2048) for sentence-level runs to fit more
+# parallel requests in VRAM.
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+
+# How long Ollama keeps the model loaded after the last request: seconds, a
+# duration such as "30m", or -1 (the default) to keep it resident between
+# documents instead of reloading it after the server's 5 minute default
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "-1")
+
 
 def build_llm() -> Any:
     """Return an LLM instance based on environment configuration.
@@ -10,27 +25,80 @@ def build_llm() -> Any:
     For Gemini, the API key is read from ``GEMINI_API_KEY`` or
     ``GOOGLE_API_KEY``. For Ollama, ``OLLAMA_HOST`` or ``OLLAMA_HOST_PC`` must
     be set.
+
+    Calls with the same configuration return the same instance, so every
+    phase shares one client and its pooled connections.
     """
     provider = os.getenv("LLM_PROVIDER", "google").lower()
 
     if provider == "ollama":
-        from langchain_ollama.llms import OllamaLLM
-
         host = os.environ.get("OLLAMA_HOST") or os.environ.get("OLLAMA_HOST_PC")
         if not host:
             raise EnvironmentError("Set OLLAMA_HOST or OLLAMA_HOST_PC")
         model_name = os.environ.get("OLLAMA_MODEL", "deepseek-r1:14b")
-        return OllamaLLM(
-            model=model_name,
-            base_url=host,
-            options={"num_ctx": 8192},
-            temperature=0.0,
-        )
-
-    from langchain_google_genai import GoogleGenerativeAI
+        return _build_ollama(model_name, host)
 
     api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
     if not api_key:
         raise EnvironmentError("Set GEMINI_API_KEY or GOOGLE_API_KEY")
     model_name = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+    return _build_gemini(model_name, api_key)
+
+
+def warm_up(model: Any) -> None:
+    """Load an Ollama *model* into server memory before the first real call.
+
+    Ollama loads a model lazily on the first request, so without this the
+    first batch of concurrent pipeline calls all wait on the load. A
+    generate request without a prompt only loads the model. It is sent with
+    the same ``num_ctx`` so the runner is not restarted by the next request.
+    How many requests the loaded model serves at once is set on the server
+    (``OLLAMA_NUM_PARALLEL`` for ``ollama serve``), not by this client.
+    Other providers are left untouched.
+    """
+    from langchain_ollama.llms import OllamaLLM
+
+    if not isinstance(model, OllamaLLM):
+        return
+    from ollama import Client
+
+    Client(host=model.base_url).generate(
+        model=model.model,
+        keep_alive=model.keep_alive,
+        options={"num_ctx": model.num_ctx},
+    )
+
+
+@lru_cache(maxsize=4)
+def _build_ollama(model_name: str, host: str) -> Any:
+    import httpx
+    from langchain_ollama.llms import OllamaLLM
+
+    return OllamaLLM(
+        model=model_name,
+        base_url=host,
+        # a num_ctx *field*: OllamaLLM silently drops an ``options=`` kwarg
+        num_ctx=OLLAMA_NUM_CTX,
+        # Ollama rejects a bare number sent as a string ("-1" has no unit)
+        keep_alive=(
+            int(OLLAMA_KEEP_ALIVE)
+            if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit()
+            else OLLAMA_KEEP_ALIVE
+        ),
+        temperature=0.0,
+        client_kwargs={
+            # HTTP/2 is only negotiated over TLS (e.g. a reverse proxy);
+            # plain http:// hosts keep using HTTP/1.1 keep-alive
+            "http2": True,
+            "limits": httpx.Limits(
+                max_keepalive_connections=OLLAMA_KEEPALIVE_CONNECTIONS
+            ),
+        },
+    )
+
+
+@lru_cache(maxsize=4)
+def _build_gemini(model_name: str, api_key: str) -> Any:
+    from langchain_google_genai import GoogleGenerativeAI
+
     return GoogleGenerativeAI(model=model_name, google_api_key=api_key, temperature=0.0)
@@ -0,0 +1,203 @@
+"""Caches for the small LLM helper calls in :mod:`LLMs`.
+
+``ExactCache`` memoises replies by (model, prompt). The models are run at
+``temperature=0`` so an identical prompt yields an identical reply; entries
+are persisted to ``LLM_CACHE_PATH`` (set it to an empty string to keep the
+cache in memory only). The file is read on the first lookup, not at import.
+
+``SemanticCache`` reuses an earlier answer when a new key is *nearly* the
+same as one already seen, judged by cosine similarity of sentence
+embeddings. It is opt-in: set ``SEMANTIC_CACHE_DIR`` and install
+``sentence-transformers``; otherwise every lookup is a miss.
+"""
+
+from __future__ import annotations
+
+import atexit
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from kg_utils import _write_atomic
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+    SentenceTransformer = None
+
+LLM_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH", str(Path.home() / ".cache" / "clearsure" / "llm_cache.json")
+)
+SEMANTIC_CACHE_DIR = os.environ.get("SEMANTIC_CACHE_DIR")
+SEMANTIC_CACHE_MODEL = os.environ.get(
+    "SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+_encoder = None
+
+
+def _get_encoder():
+    global _encoder
+    if _encoder is None:
+        _encoder = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+    return _encoder
+
+
+class ExactCache:
+    """LRU cache of LLM replies keyed by model name and the full prompt.
+
+    Only models configured with ``temperature=0`` are cached; anything else
+    always misses. Keys are SHA-1 digests so the on-disk file stays small.
+    """
+
+    def __init__(
+        self, path: str | os.PathLike | None = LLM_CACHE_PATH, maxsize: int = 100_000
+    ) -> None:
+        self.path = Path(path) if path else None
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._dirty = False
+        self._loaded = self.path is None
+
+    def _load(self) -> None:
+        # deferred to the first lookup so a cache replaced before use (e.g. by
+        # ``--no-cache``) never reads the file or registers its exit hook
+        self._loaded = True
+        if self.path.exists():
+            stored = json.loads(self.path.read_text(encoding="utf-8"))
+            stored.update(self._entries)
+            self._entries = OrderedDict(stored)
+        atexit.register(self.save)
+
+    @staticmethod
+    def _key(model, prompt: str) -> str | None:
+        if getattr(model, "temperature", None) != 0:
+            return None
+        name = getattr(model, "model", "") or type(model).__name__
+        return hashlib.sha1(f"{name}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, model, prompt: str) -> str | None:
+        """Return the cached reply for *prompt* on *model*, or ``None``."""
+        key = self._key(model, prompt)
+        if key is None:
+            return None
+        if not self._loaded:
+            self._load()
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, model, prompt: str, reply: str) -> None:
+        key = self._key(model, prompt)
+        if key is None:
+            return
+        if not self._loaded:
+            self._load()
+        self._entries[key] = reply
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def save(self) -> None:
+        """Write the cache to ``path`` if it changed since the last save."""
+        if self.path is None or not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # a torn file would fail to load and stop every later run at import
+        _write_atomic(
+            self.path, json.dumps(self._entries, ensure_ascii=False).encode("utf-8")
+        )
+        self._dirty = False
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of LLM answers keyed by text embeddings.
+
+    A lookup embeds the key and takes one matrix-vector product against all
+    stored (normalised) keys. Entries live in ``<directory>/<name>.npy`` and
+    ``<directory>/<name>.json`` and are written back at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: str | os.PathLike | None = SEMANTIC_CACHE_DIR,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+    ) -> None:
+        self.enabled = directory is not None and SentenceTransformer is not None
+        self.threshold = threshold
+        self._vectors = None  # preallocated rows; only [:_size] are valid
+        self._size = 0
+        self._answers: list[Any] = []
+        self._last: tuple[str, Any] | None = None
+        self._dirty = False
+        if not self.enabled:
+            return
+
+        self._vec_path = Path(directory) / f"{name}.npy"
+        self._ans_path = Path(directory) / f"{name}.json"
+        if self._vec_path.exists() and self._ans_path.exists():
+            vectors = np.load(self._vec_path)
+            answers = json.loads(self._ans_path.read_text(encoding="utf-8"))
+            # the two files are replaced one after the other; after a crash
+            # in between, row i would no longer belong to answer i
+            if len(vectors) == len(answers):
+                self._vectors = vectors
+                self._answers = answers
+                self._size = len(answers)
+        atexit.register(self.save)
+
+    def _embed(self, key: str):
+        # get() followed by put() embeds the same key; reuse the vector
+        if self._last is not None and self._last[0] == key:
+            return self._last[1]
+        vec = _get_encoder().encode(key, normalize_embeddings=True).astype(np.float32)
+        self._last = (key, vec)
+        return vec
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """Return ``(True, answer)`` for a close enough key, else ``(False, None)``."""
+        if not self.enabled or self._size == 0:
+            return False, None
+        scores = self._vectors[: self._size] @ self._embed(key)
+        best = int(scores.argmax())
+        if scores[best] >= self.threshold:
+            return True, self._answers[best]
+        return False, None
+
+    def put(self, key: str, answer: Any) -> None:
+        """Store *answer* under the embedding of *key*."""
+        if not self.enabled:
+            return
+        vec = self._embed(key)
+        if self._vectors is None:
+            self._vectors = np.empty((64, vec.size), dtype=np.float32)
+        elif self._size == len(self._vectors):
+            grow = np.empty((max(64, self._size), vec.size), dtype=np.float32)
+            self._vectors = np.concatenate([self._vectors, grow])
+        self._vectors[self._size] = vec
+        self._size += 1
+        self._answers.append(answer)
+        self._dirty = True
+
+    def save(self) -> None:
+        """Write the cache to disk if it changed since the last save."""
+        if not self.enabled or not self._dirty:
+            return
+        self._vec_path.parent.mkdir(parents=True, exist_ok=True)
+        buf = io.BytesIO()
+        np.save(buf, self._vectors[: self._size])
+        _write_atomic(self._vec_path, buf.getvalue())
+        _write_atomic(
+            self._ans_path, json.dumps(self._answers, ensure_ascii=False).encode("utf-8")
+        )
+        self._dirty = False
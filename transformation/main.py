@@ -1,8 +1,8 @@
-import json
 import argparse
+from bisect import bisect_right
 from pathlib import Path
 
-from llm import build_llm
+from llm import build_llm, warm_up
 
 from pipeline import (
     prepare_input_file,
@@ -17,7 +17,9 @@ from pipeline import (
 )
 from run_pipeline import load_and_push, clear_database
 import doc_tree
-from kg_utils import update_kg, clean_kg, consolidate_rules_to_topics
+import pipeline
+import LLMs
+from kg_utils import kg_session, consolidate_rules_to_topics, _dumps, _loads, _write_atomic
 
 VERBOSE = False
 
@@ -32,64 +34,83 @@ RESET_DB = True
 TOPIC_TREE_PATH = STRUCTURED_DIR / "topic_tree.json"
 
 
-def _find_topic(node: doc_tree.Node, start: int, end: int) -> doc_tree.Node | None:
-    """Return the deepest topic ``node`` covering the character span."""
-    if start < node.char_start or end > node.char_end:
-        return None
-    for child in node.children:
-        match = _find_topic(child, start, end)
-        if match is not None:
-            return match
-    return node
-
-
-def phase1_sentence_kg(text_path: Path) -> None:
+def _topic_finder(root: doc_tree.Node):
+    """Return ``find(start, end)`` giving the deepest topic covering a span.
+
+    Sibling topics are disjoint and ordered by ``char_start`` (see
+    ``doc_tree.phase2``), so on each level only the last child starting at
+    or before *start* can cover the span; it is found by bisection instead
+    of trying every child recursively.
+    """
+    starts: dict[str, list[int]] = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.children:
+            starts[node.id] = [child.char_start for child in node.children]
+            stack.extend(node.children)
+
+    def find(start: int, end: int) -> doc_tree.Node | None:
+        if start < root.char_start or end > root.char_end:
+            return None
+        node = root
+        while node.children:
+            i = bisect_right(starts[node.id], start) - 1
+            if i < 0 or end > node.children[i].char_end:
+                break
+            node = node.children[i]
+        return node
+
+    return find
+
+
+def phase1_sentence_kg(text_path: Path, model=None) -> None:
     """Run phase 1: sentence-level KG extraction."""
-    model = build_llm()
+    model = model or build_llm()
     input_basename = prepare_input_file(text_path)
-    process_document(model, input_file=input_basename)
+    # phase 2 resets and rebuilds final_kg.json, so don't merge into it here
+    process_document(model, input_file=input_basename, merge=False)
 
 
-def phase2_summary(text_path: Path) -> None:
+def phase2_summary(text_path: Path, model=None) -> None:
     """Build topic tree and merge sentence KGs into ``final_kg.json``."""
-    model = build_llm()
+    model = model or build_llm()
 
     text = extract_text(text_path)
 
     tree = doc_tree.build_tree(text, model)
-    TOPIC_TREE_PATH.write_text(json.dumps(tree.to_dict(), indent=2), encoding="utf-8")
+    _write_atomic(TOPIC_TREE_PATH, _dumps(tree.to_dict()))
 
     reset_final_kg(FINAL_KG_PATH, backup=False, verbose=VERBOSE)
-
-    # Insert Topic nodes into the KG before linking statements to them
-    topic_nodes, child_edges = doc_tree.flatten_tree(tree)
-    if topic_nodes or child_edges:
-        update_kg({"nodes": topic_nodes, "edges": child_edges}, kg_path=FINAL_KG_PATH)
-
-    sentence_kgs = json.loads(SENTENCE_KGS_PATH.read_text(encoding="utf-8"))
-
-    for sent in sentence_kgs:
-        kg_patch = sent.get("kg", {})
-        kg, id_map = update_kg(kg_patch, kg_path=FINAL_KG_PATH, return_id_map=True)
-
-        topic = _find_topic(tree, sent.get("char_start", 0), sent.get("char_end", 0))
-        edges = []
-        if topic:
-            for node in kg_patch.get("nodes", []):
-                if node.get("type") == "Statement":
-                    new_id = id_map.get(node["id"], node["id"])
-                    edges.append({
-                        "source": topic.id,
-                        "relation": "HAS_STATEMENT",
-                        "target": new_id,
-                    })
-        if edges:
-            clean_kg({"edges_patch": edges}, kg_path=FINAL_KG_PATH)
-
-    # Simplify topic links by attaching rules directly to their topics
-    kg = json.loads(FINAL_KG_PATH.read_text(encoding="utf-8"))
-    kg = consolidate_rules_to_topics(kg)
-    FINAL_KG_PATH.write_text(json.dumps(kg, indent=2), encoding="utf-8")
+    sentence_kgs = _loads(SENTENCE_KGS_PATH.read_bytes())
+    find_topic = _topic_finder(tree)
+
+    # Loaded once, merged in memory, written once when the block exits
+    with kg_session(FINAL_KG_PATH) as graph:
+        # Insert Topic nodes into the KG before linking statements to them
+        topic_nodes, child_edges = doc_tree.flatten_tree(tree)
+        if topic_nodes or child_edges:
+            graph.apply_patch({"nodes": topic_nodes, "edges": child_edges})
+
+        for sent in sentence_kgs:
+            kg_patch = sent.get("kg", {})
+            nodes = kg_patch.get("nodes", [])
+
+            # HAS_STATEMENT edges use the patch's own statement IDs; update_kg
+            # renumbers them together with the sentence's nodes and edges
+            topic = find_topic(sent.get("char_start", 0), sent.get("char_end", 0))
+            links = []
+            if topic:
+                links = [
+                    {"source": topic.id, "relation": "HAS_STATEMENT", "target": node["id"]}
+                    for node in nodes
+                    if node.get("type") == "Statement"
+                ]
+
+            graph.apply_patch({"nodes": nodes, "edges": kg_patch.get("edges", []) + links})
+
+        # Simplify topic links by attaching rules directly to their topics
+        consolidate_rules_to_topics(graph)
 
     return None
 
@@ -97,7 +118,8 @@ def phase2_summary(text_path: Path) -> None:
 def push_to_neo4j() -> None:
     if RESET_DB:
         clear_database(drop_meta=True)
-    load_and_push(save_to=OUT_PATH)
+    # without the reset, earlier pushes of this KG are still in the database
+    load_and_push(save_to=OUT_PATH, merge=not RESET_DB)
 
 
 def parse_args() -> argparse.Namespace:
@@ -110,6 +132,11 @@ def parse_args() -> argparse.Namespace:
     )
     p.add_argument("--no-reset-db", action="store_true", help="Keep existing Neo4j data")
     p.add_argument("-v", "--verbose", action="store_true", help="Print progress")
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached LLM replies, e.g. after re-pulling a model under the same name",
+    )
     return p.parse_args()
 
 
@@ -119,15 +146,22 @@ def main() -> None:
     RESET_DB = not args.no_reset_db
     VERBOSE = args.verbose
     doc_tree.VERBOSE = VERBOSE
+    pipeline.VERBOSE = VERBOSE
+    if args.no_cache:
+        LLMs.disable_cache()
 
     log(f"📄 Using input file: {args.input}")
     if not args.input.exists():
         raise FileNotFoundError(args.input)
 
+    # One client for both phases so pooled connections are reused
+    model = build_llm()
+    warm_up(model)
+
     log("🚀 Phase 1: Sentence KG extraction")
-    phase1_sentence_kg(args.input)
+    phase1_sentence_kg(args.input, model)
     log("🚀 Phase 2: Build summary and merge KGs")
-    phase2_summary(args.input)
+    phase2_summary(args.input, model)
     log("🚀 Pushing KG to Neo4j")
     push_to_neo4j()
 
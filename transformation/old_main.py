@@ -5,11 +5,9 @@ from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from pathlib import Path
 import spacy
-import json
-import requests
 from LLMs import simplify_text, remove_think_block, create_knowledge_ontology, clean_up_1st_phase
 from run_pipeline import load_and_push, clear_database
-from kg_utils import clean_kg
+from kg_utils import clean_kg, _dumps, _loads, _write_atomic
 
 try:
     # load environment variables from .env file (requires `python-dotenv`)
@@ -20,7 +18,10 @@ except ImportError:
     pass
 
 
-if os.environ["LANGSMITH_TRACING"] == "true":
+# LangSmith sends every model call to its backend (one extra HTTP POST per
+# call), so it stays off unless LANGSMITH_TRACING=true is set explicitly
+TRACE = os.environ.get("LANGSMITH_TRACING", "false").lower() == "true"
+if TRACE:
     if "LANGSMITH_API_KEY" not in os.environ:
         os.environ["LANGSMITH_API_KEY"] = getpass.getpass(
             prompt="Enter your LangSmith API key (optional): "
@@ -36,7 +37,7 @@ os.environ["OLLAMA_HOST"] = os.environ["OLLAMA_HOST_PC"]
 PAUSE = True
 
 model = OllamaLLM(model="deepseek-r1:14b",
-    options={"num_ctx": 8192},     #number of tokens an LLM accepts as input. Both system message and user message              
+    num_ctx=8192,     #number of tokens an LLM accepts as input. Both system message and user message              
     base_url=os.environ["OLLAMA_HOST"],
     temperature=0.0,)
 
@@ -50,11 +51,11 @@ FINAL_KG_PATH = BASE_DIR / "structured" / "final_kg.json"
 def save(text: str, file: str) -> str:
     output_file = file_path / file
     if isinstance(text, (dict, list)):
-        text_str = json.dumps(text, ensure_ascii=False, indent=2)
-    else:
-        text_str = str(text)
-    with output_file.open("w", encoding="utf-8") as f:
-        f.write(text_str)
+        data = _dumps(text)
+        _write_atomic(output_file, data)
+        return data.decode("utf-8")
+    text_str = str(text)
+    _write_atomic(output_file, text_str.encode("utf-8"))
     return text_str
 
 def load(file: str) -> str:
@@ -80,7 +81,7 @@ if(PAUSE):
     print("✅✅✅✅✅✅✅✅ Inspected text: \n",result)
     
 if(PAUSE):
-    kg = json.loads(load("final_kg.json"))
+    kg = _loads((file_path / "final_kg.json").read_bytes())
     # print("✅✅✅✅✅✅✅✅ Input: \n",kg)
     raw_output = clean_up_1st_phase(kg,model)
     clean_output = remove_think_block(raw_output)
@@ -1,22 +1,22 @@
 # ------------------------------------------------------------------
 # 0.  utilities ----------------------------------------------------
 # ------------------------------------------------------------------
-import json
+import os
 from pathlib import Path
 from typing import Dict, Any, Iterable
 import spacy, warnings
 import argparse
-import pdfplumber
-from kg_utils import _extract_json_block, update_kg, clean_kg
+import doc_io
+from kg_utils import KG, _parse_llm_json, _dumps, _write_atomic, compact_kg, infer_patch_edges, kg_session
 from LLMs import (
-    simplify_text,
+    simplify_text_many,
     remove_think_block,
-    create_knowledge_ontology,
-    clean_up_1st_phase,
-    label_text,
+    create_knowledge_ontology_batch,
+    clean_up_1st_phase_many,
+    label_text_many,
     clean_label,
 )
-from llm import build_llm
+from llm import build_llm, warm_up
 
 try:
     # load environment variables from .env file (requires `python-dotenv`)
@@ -33,20 +33,39 @@ INPUT_PATH = STRUCTURED_DIR / "input.txt"
 OUT_PATH = STRUCTURED_DIR / "import_kg.cypher"
 SENTENCE_KGS_PATH = STRUCTURED_DIR / "sentence_kgs.json"
 
+# Sentences per ontology LLM call; 8 prompts + replies fit in num_ctx=8192
+ONTOLOGY_BATCH_SIZE = 8
+# Worker threads per LLM stage, i.e. prompts in flight at once (see
+# LLMs._batch). Ollama queues requests beyond its OLLAMA_NUM_PARALLEL slots,
+# so set both to the same value.
+LLM_CONCURRENCY = int(os.environ.get("PIPELINE_CONCURRENCY", "8"))
+# Set LLM_CLEANUP=1 to ask the model for the first-pass clean-up edges
+# instead of deriving them with kg_utils.infer_patch_edges
+LLM_CLEANUP = os.environ.get("LLM_CLEANUP", "") == "1"
+
+# Echo every sentence and LLM reply; off by default, as that is several
+# writes per sentence
+VERBOSE = False
+
+
+def log(msg: str) -> None:
+    if VERBOSE:
+        print(msg)
+
 
 def save(text: str, file: str) -> str:
     output_file = STRUCTURED_DIR / file
     if isinstance(text, (dict, list)):
-        text_str = json.dumps(text, ensure_ascii=False, indent=2)
-    else:
-        text_str = str(text)
-    with output_file.open("w", encoding="utf-8") as f:
-        f.write(text_str)
+        data = _dumps(text)
+        _write_atomic(output_file, data)
+        return data.decode("utf-8")
+    text_str = str(text)
+    _write_atomic(output_file, text_str.encode("utf-8"))
     return text_str
 
 
 def load_text(file_name: str) -> str:
-    return (STRUCTURED_DIR / file_name).read_text(encoding="utf-8")
+    return doc_io.read_utf8(STRUCTURED_DIR / file_name)
 
 
 def ensure_final_kg_exists() -> None:
@@ -54,20 +73,17 @@ def ensure_final_kg_exists() -> None:
     Make sure final_kg.json exists and has the minimal structure.
     """
     if not FINAL_KG_PATH.exists():
-        FINAL_KG_PATH.write_text(json.dumps({"nodes": [], "edges": []}, indent=2))
+        _write_atomic(FINAL_KG_PATH, _dumps({"nodes": [], "edges": []}))
 
 
 def extract_text(path: Path) -> str:
     """Return plain text extracted from *path*.
 
-    Currently supports PDF via pdfplumber; other files are read as UTF-8.
+    Delegates to ``doc_io.extract_text``: PDFs via pdfplumber, with long
+    documents extracted in parallel page ranges; other files as UTF-8 text,
+    decoded the same way as ``load_text``.
     """
-    if path.suffix.lower() == ".pdf":
-        with pdfplumber.open(path) as pdf:
-            pages = [page.extract_text() or "" for page in pdf.pages]
-        return "\n".join(pages)
-
-    return path.read_text(encoding="utf-8")
+    return doc_io.extract_text(path)
 
 
 def prepare_input_file(src: Path, dest: Path = STRUCTURED_DIR / "output.json") -> str:
@@ -77,7 +93,7 @@ def prepare_input_file(src: Path, dest: Path = STRUCTURED_DIR / "output.json") -
     """
     dest.parent.mkdir(parents=True, exist_ok=True)
     text = extract_text(src)
-    dest.write_text(text, encoding="utf-8")
+    _write_atomic(dest, text.encode("utf-8"))
     return dest.name
 
 
@@ -86,8 +102,15 @@ def prepare_input_file(src: Path, dest: Path = STRUCTURED_DIR / "output.json") -
 # ------------------------------------------------------------------
 # use spaCy's small English model for sentence boundary detection
 try:
-    # keep the parser so abbreviations like "Dr." don't trigger splits
-    _nlp = spacy.load("en_core_web_sm", disable=["tagger", "ner"])
+    # the trained sentence recognizer ("senter", shipped disabled) keeps
+    # abbreviations like "Dr." from triggering splits, as the parser did, at a
+    # fraction of the parser's cost; nothing else is read here, so the other
+    # components are not even loaded
+    _nlp = spacy.load(
+        "en_core_web_sm",
+        exclude=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner"],
+    )
+    _nlp.enable_pipe("senter")
 except OSError:
     # model missing → fall back to a blank pipeline + simple sentencizer
     warnings.warn("en_core_web_sm not found; using blank 'en' + sentencizer")
@@ -103,24 +126,11 @@ def split_into_sentences(text: str) -> Iterable[tuple[str, int, int]]:
 
     ``start`` and ``end`` are character offsets (inclusive) referring to the
     original text.  Leading/trailing whitespace is stripped from the returned
-    sentence and offsets adjusted accordingly.
+    sentence and offsets adjusted accordingly. Spans are cached per text, so
+    re-running a document skips the spaCy pass.
     """
-
-    doc = _nlp(text)
-    for sent in doc.sents:
-        raw = sent.text
-        if not raw.strip():
-            continue
-
-        start = sent.start_char
-        end = sent.end_char - 1  # spaCy end_char is exclusive
-
-        lstrip = len(raw) - len(raw.lstrip())
-        rstrip = len(raw) - len(raw.rstrip())
-
-        start += lstrip
-        end -= rstrip
-        yield raw.strip(), start, end
+    for start, end in doc_io.document_spans(text, _nlp, inclusive=True):
+        yield text[start : end + 1], start, end
 
 
 import shutil, time
@@ -142,42 +152,53 @@ def reset_final_kg(
     path.parent.mkdir(parents=True, exist_ok=True)
 
     if path.exists() and backup:
+        # fold in any append journal first so the backup is the whole KG
+        compact_kg(path)
         ts = time.strftime("%Y%m%d-%H%M%S")
         backup_path = path.with_suffix(path.suffix + f".bak.{ts}")
-        shutil.copy2(path, backup_path)
+        try:
+            # the file is only ever replaced via _write_atomic, never written
+            # in place, so a hard link keeps the old contents without a copy
+            os.link(path, backup_path)
+        except OSError:
+            shutil.copy2(path, backup_path)
         if verbose:
             print(f"📦 Backed up existing KG to {backup_path}")
 
     empty = {"nodes": [], "edges": []}
-    path.write_text(json.dumps(empty, indent=2), encoding="utf-8")
+    _write_atomic(path, _dumps(empty))
+    # drop any append journal left over from kg_utils' mode="append"
+    path.with_suffix(".jsonl").unlink(missing_ok=True)
     if verbose:
         print(f"🧹 Reset KG at {path}")
     return empty
 
 
-def _max_topic_index(nodes: list[dict]) -> int:
-    idx = [int(n["id"][1:]) for n in nodes if n.get("id", "").startswith("t")]
-    return max(idx, default=0)
-
+def build_topic_tree(graph: KG, model) -> dict:
+    """Return topic nodes and edges linking statements to them.
 
-def build_topic_tree(kg: dict, model) -> dict:
-    """Return topic nodes and edges linking statements to them."""
+    New topic IDs continue from ``graph.node_max["t"]``, which the graph keeps
+    current as nodes are merged, so the KG isn't rescanned for them.
+    """
     statements = [
         (n["id"], n.get("label", ""))
-        for n in kg.get("nodes", [])
+        for n in graph.data["nodes"]
         if n.get("type") == "Statement"
     ]
     if not statements:
         return {"nodes": [], "edges": []}
 
     groups = [statements[i : i + 5] for i in range(0, len(statements), 5)]
-    next_idx = _max_topic_index(kg.get("nodes", []))
+    next_idx = graph.node_max["t"]
     nodes: list[dict] = []
     edges: list[dict] = []
 
-    for grp in groups:
-        text = " ".join(lbl for _, lbl in grp)
-        raw = label_text(text, model)
+    raw_labels = label_text_many(
+        [" ".join(lbl for _, lbl in grp) for grp in groups],
+        model,
+        max_concurrency=LLM_CONCURRENCY,
+    )
+    for grp, raw in zip(groups, raw_labels):
         label = clean_label(raw)
         next_idx += 1
         tid = f"t{next_idx}"
@@ -191,8 +212,16 @@ def build_topic_tree(kg: dict, model) -> dict:
 # ------------------------------------------------------------------
 # 2.  core loop ----------------------------------------------------
 # ------------------------------------------------------------------
-def process_document(model, input_file: str = "output.json") -> list[dict]:
-    """Extract a KG for each sentence and store all of them in ``sentence_kgs.json``."""
+def process_document(
+    model, input_file: str = "output.json", merge: bool = True
+) -> list[dict]:
+    """Extract a KG for each sentence and store all of them in ``sentence_kgs.json``.
+
+    With *merge* the sentence KGs are also merged into ``final_kg.json`` and
+    grouped under LLM-labelled topics. ``main.py`` passes ``merge=False``
+    because its phase 2 rebuilds that file from ``sentence_kgs.json`` with
+    the document's topic tree.
+    """
 
     raw_text = load_text(input_file)
     sentences = list(split_into_sentences(raw_text))
@@ -200,68 +229,103 @@ def process_document(model, input_file: str = "output.json") -> list[dict]:
 
     SENTENCE_KGS_PATH.parent.mkdir(parents=True, exist_ok=True)
     sentence_kgs: list[dict] = []
-    SENTENCE_KGS_PATH.write_text("[]", encoding="utf-8")
-    ensure_final_kg_exists()
-
-    for idx, (sentence, start_pos, end_pos) in enumerate(sentences, start=1):
-        print(f"—— Sentence {idx}/{len(sentences)} ——")
-        print(f"—— Sentence —— {sentence}")
-
-        # ------------------------------------------------------
-        # (A) simplify
-        # ------------------------------------------------------
-        simplified_txt = remove_think_block(simplify_text(sentence, model))
-        print("✅✅✅✅✅✅ Simplified text:", simplified_txt)
-
-        # ------------------------------------------------------
-        # (B) ontology generation
-        # ------------------------------------------------------
-        kg_patch_txt = remove_think_block(
-            create_knowledge_ontology(simplified_txt, model)
+    _write_atomic(SENTENCE_KGS_PATH, b"[]")
+
+    # ------------------------------------------------------
+    # (A) simplify, LLM_CONCURRENCY sentences in flight
+    # ------------------------------------------------------
+    simplified = [
+        remove_think_block(reply)
+        for reply in simplify_text_many(
+            [sentence for sentence, _, _ in sentences],
+            model,
+            max_concurrency=LLM_CONCURRENCY,
         )
-        print("✅✅✅✅✅✅ Ontology:", kg_patch_txt)
+    ]
+    if VERBOSE:
+        for idx, ((sentence, _, _), simplified_txt) in enumerate(
+            zip(sentences, simplified), start=1
+        ):
+            log(f"—— Sentence {idx}/{len(sentences)} ——")
+            log(f"—— Sentence —— {sentence}")
+            log(f"✅✅✅✅✅✅ Simplified text: {simplified_txt}")
+
+    # ------------------------------------------------------
+    # (B) ontology generation, several sentences per LLM call
+    # ------------------------------------------------------
+    ontologies = create_knowledge_ontology_batch(
+        simplified,
+        model,
+        batch_size=ONTOLOGY_BATCH_SIZE,
+        max_concurrency=LLM_CONCURRENCY,
+    )
 
-        # ------------------------------------------------------
-        # (C) clean-up first pass
-        # ------------------------------------------------------
+    patches: list[dict | None] = []
+    for idx, ontology in enumerate(ontologies, start=1):
+        kg_patch_txt = remove_think_block(ontology)
+        log(f"✅✅✅✅✅✅ Ontology {idx}/{len(sentences)}: {kg_patch_txt}")
         try:
-            kg_patch_dict = json.loads(_extract_json_block(kg_patch_txt))
+            patches.append(_parse_llm_json(kg_patch_txt))
         except ValueError as e:
             print(f"⚠️ Skipping sentence; could not parse ontology JSON: {e}")
-            continue
+            patches.append(None)
+
+    # ------------------------------------------------------
+    # (C) clean-up first pass: rule-derived edges, or (LLM_CLEANUP) one
+    #     more LLM call per sentence, LLM_CONCURRENCY in flight
+    # ------------------------------------------------------
+    if LLM_CLEANUP:
+        cleaned = iter(
+            clean_up_1st_phase_many(
+                [p for p in patches if p is not None],
+                model,
+                max_concurrency=LLM_CONCURRENCY,
+            )
+        )
 
-        cleaned_patch_txt = remove_think_block(clean_up_1st_phase(kg_patch_dict, model))
-        print("✅✅✅✅✅✅ Cleaned Edges:", cleaned_patch_txt)
+    for (sentence, start_pos, end_pos), kg_patch_dict in zip(sentences, patches):
+        if kg_patch_dict is None:
+            continue
 
-        try:
-            edges_patch = json.loads(_extract_json_block(cleaned_patch_txt)).get("edges_patch", [])
-        except ValueError as e:
-            print(f"⚠️ Could not parse cleaned edges JSON: {e}")
-            edges_patch = []
-
-        sentence_kg = {
-            "sentence": sentence,
-            "char_start": start_pos,
-            "char_end": end_pos,
-            "kg": {
-                "nodes": kg_patch_dict.get("nodes", []),
-                "edges": kg_patch_dict.get("edges", []) + edges_patch,
-            },
-        }
-
-        sentence_kgs.append(sentence_kg)
-        SENTENCE_KGS_PATH.write_text(
-            json.dumps(sentence_kgs, indent=2, ensure_ascii=False), encoding="utf-8"
+        if LLM_CLEANUP:
+            cleaned_patch_txt = remove_think_block(next(cleaned))
+            try:
+                edges_patch = _parse_llm_json(cleaned_patch_txt).get("edges_patch", [])
+            except ValueError as e:
+                print(f"⚠️ Could not parse cleaned edges JSON: {e}")
+                edges_patch = []
+        else:
+            edges_patch = infer_patch_edges(kg_patch_dict)
+        log(f"✅✅✅✅✅✅ Cleaned Edges: {edges_patch}")
+
+        sentence_kgs.append(
+            {
+                "sentence": sentence,
+                "char_start": start_pos,
+                "char_end": end_pos,
+                "kg": {
+                    "nodes": kg_patch_dict.get("nodes", []),
+                    "edges": kg_patch_dict.get("edges", []) + edges_patch,
+                },
+            }
         )
 
-        kg_patch = sentence_kg["kg"]
-        update_kg(kg_patch, kg_path=FINAL_KG_PATH)
+    _write_atomic(SENTENCE_KGS_PATH, _dumps(sentence_kgs))
+    if not merge:
+        return sentence_kgs
+
+    # ------------------------------------------------------
+    # (D) merge, in memory; final_kg.json is written once at the end
+    # ------------------------------------------------------
+    ensure_final_kg_exists()
+    with kg_session(FINAL_KG_PATH) as graph:
+        for sentence_kg in sentence_kgs:
+            graph.apply_patch(sentence_kg["kg"])
 
-    # Build topics after all sentences are processed
-    current_kg = json.loads(FINAL_KG_PATH.read_text(encoding="utf-8"))
-    topic_patch = build_topic_tree(current_kg, model)
-    if topic_patch["nodes"] or topic_patch["edges"]:
-        clean_kg({"nodes": topic_patch["nodes"], "edges_patch": topic_patch["edges"]}, kg_path=FINAL_KG_PATH)
+        # Build topics after all sentences are processed
+        topic_patch = build_topic_tree(graph, model)
+        if topic_patch["nodes"] or topic_patch["edges"]:
+            graph.apply_edges({"nodes": topic_patch["nodes"], "edges_patch": topic_patch["edges"]})
 
     return sentence_kgs
 
@@ -274,9 +338,12 @@ if __name__ == "__main__":
         description="Extract a document into a KG and push to Neo4j"
     )
     parser.add_argument("path", type=Path, help="Path to a PDF or text file to process")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every LLM reply")
     args = parser.parse_args()
+    VERBOSE = args.verbose
 
     model = build_llm()
+    warm_up(model)
 
     input_file = prepare_input_file(args.path)
 
@@ -1,9 +1,10 @@
 # run_pipeline.py
-import json, itertools
+import itertools
+from functools import lru_cache
 from neo4j import GraphDatabase
-from contextlib import ExitStack
 from pathlib import Path
 from convert import clean_relation, escape               # reuse your helpers
+from kg_utils import _dumps, _read_kg
 import pathlib
 
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -12,40 +13,97 @@ OUT_PATH  = BASE_DIR / "structured" / "import_kg.cypher"
 BOLT_URI  = "bolt://localhost:7687"
 driver    = GraphDatabase.driver(BOLT_URI, auth=("neo4j", "12345678"))
 
+@lru_cache(maxsize=None)
+def _rel_type(relation):
+    # a KG uses a handful of relations across thousands of edges
+    return clean_relation(escape(relation))
+
+def _cypher_props(props):
+    return ", ".join([f"{k}: {_dumps(v, indent=None).decode()}" for k, v in props.items()])
+
 def kg_to_statements(kg):
+    for row in _node_rows(kg):
+        prop_str = _cypher_props(row["props"])
+        yield f'CREATE (:Entity {{id: "{row["id"]}", label: "{escape(row["label"])}"{", " + prop_str if prop_str else ""}}});'
+
+    for e in kg["edges"]:
+        attr = e.get("attributes")
+        a_str = f" {{ {_cypher_props(attr)} }}" if attr else ""
+        yield (
+            f'MATCH (a {{id: "{e["source"]}"}}), (b {{id: "{e["target"]}"}}) '
+            f'CREATE (a)-[:{_rel_type(e["relation"])}{a_str}]->(b);'
+        )
+
+NEO4J_BATCH_SIZE = 10_000
+
+def _node_rows(kg):
     for n in kg["nodes"]:
         props = {k: v for k, v in n.items() if k not in ("id", "label")}
         if "attributes" in props:
             props.update(props.pop("attributes"))
-        prop_str = ", ".join(f'{k}: {json.dumps(v)}' for k, v in props.items())
-        yield f'CREATE (:Entity {{id: "{n["id"]}", label: "{escape(n["label"])}"{", " + prop_str if prop_str else ""}}});'
+        yield {"id": n["id"], "label": n["label"], "props": props}
 
+def _edge_rows(kg):
+    """Group edge rows by relationship type, which Cypher can't parametrise."""
+    by_type = {}
     for e in kg["edges"]:
-        attr = e.get("attributes") or {}
-        a_str = (" { " + ", ".join(f'{k}: {json.dumps(v)}' for k, v in attr.items()) + " }") if attr else ""
-        yield (
-            f'MATCH (a {{id: "{e["source"]}"}}), (b {{id: "{e["target"]}"}}) '
-            f'CREATE (a)-[:{clean_relation(escape(e["relation"]))}{a_str}]->(b);'
-        )
+        rel = _rel_type(e["relation"])
+        row = {"source": e["source"], "target": e["target"], "attr": e.get("attributes") or {}}
+        by_type.setdefault(rel, []).append(row)
+    return by_type
+
+def _write_batch(tx, query, rows):
+    tx.run(query, rows=rows).consume()
 
-def load_and_push(save_to: Path | None = None) -> None:
-    kg     = json.loads(KG_PATH.read_text(encoding="utf-8"))
-    stmts  = kg_to_statements(kg)
+def load_and_push(save_to: Path | None = None, merge: bool = False) -> None:
+    """Push final_kg.json to Neo4j with batched ``UNWIND`` queries.
 
-    with ExitStack() as stack:
-        sess   = stack.enter_context(driver.session())
-        tx     = stack.enter_context(sess.begin_transaction())   # ← open TX
-        writer = stack.enter_context(save_to.open("w", encoding="utf-8")) if save_to else None
+    Each batch of ``NEO4J_BATCH_SIZE`` rows is committed as its own
+    transaction, so the server never holds the whole import uncommitted.
+    Into an emptied database plain ``CREATE`` is enough. With *merge*, for
+    a database that was not cleared, nodes are matched on ``id`` and edges
+    on their endpoints and type, so re-pushing the KG (e.g. after an import
+    that failed half-way) does not duplicate what is already there.
+    *save_to* additionally receives the equivalent one-statement-per-row
+    Cypher script.
+    """
+    verb = "MERGE" if merge else "CREATE"
+    # includes anything merged with mode="append" and not yet compacted
+    kg     = _read_kg(KG_PATH)
 
-        for i, stmt in enumerate(stmts, 1):
-            if writer:
-                writer.write(stmt + "\n")
-            tx.run(stmt)               # ← run one statement
-            # optional progress log every 1 000 rows
-            if i % 1000 == 0:
-                print(f"{i} statements sent…")
+    if save_to:
+        with save_to.open("w", encoding="utf-8", buffering=1 << 20) as writer:
+            writer.writelines(f"{stmt}\n" for stmt in kg_to_statements(kg))
 
-        tx.commit()
+    with driver.session() as sess:
+        # edges look their endpoints up by id; without an index every
+        # lookup scans all nodes
+        sess.run("CREATE INDEX entity_id IF NOT EXISTS FOR (n:Entity) ON (n.id)")
+        # the index is built in the background; wait so the edge MATCHes use it
+        sess.run("CALL db.awaitIndex('entity_id')").consume()
+        sent = 0
+        for rows in _chunk(_node_rows(kg), NEO4J_BATCH_SIZE):
+            sess.execute_write(
+                _write_batch,
+                "UNWIND $rows AS r "
+                f"{verb} (n:Entity {{id: r.id}}) SET n.label = r.label, n += r.props",
+                rows,
+            )
+            sent += len(rows)
+            print(f"{sent} nodes sent…")
+        sent = 0
+        for rel, edges in _edge_rows(kg).items():
+            for rows in _chunk(edges, NEO4J_BATCH_SIZE):
+                sess.execute_write(
+                    _write_batch,
+                    "UNWIND $rows AS r "
+                    "MATCH (a:Entity {id: r.source}) WITH r, a "
+                    "MATCH (b:Entity {id: r.target}) "
+                    f"{verb} (a)-[x:{rel}]->(b) SET x += r.attr",
+                    rows,
+                )
+                sent += len(rows)
+        print(f"{sent} edges sent…")
 
 def clear_database(drop_meta: bool = False) -> None:
     with driver.session() as sess:
@@ -1,12 +1,16 @@
-import json
 from pathlib import Path
 import argparse
 
-from llm import build_llm
+from llm import build_llm, warm_up
 
-from LLMs import simplify_text, remove_think_block, create_knowledge_ontology
-from kg_utils import _extract_json_block
-from pipeline import split_into_sentences, extract_text
+from LLMs import simplify_text_many, remove_think_block, create_knowledge_ontology_batch
+from kg_utils import _parse_llm_json, _dumps, _write_atomic
+from pipeline import (
+    split_into_sentences,
+    extract_text,
+    ONTOLOGY_BATCH_SIZE,
+    LLM_CONCURRENCY,
+)
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 STRUCTURED_DIR = BASE_DIR / "structured"
@@ -15,11 +19,22 @@ STRUCTURED_DIR.mkdir(parents=True, exist_ok=True)
 
 def sentence_kgs(text: str, model) -> list[dict]:
     """Return list of {{"sentence": str, "kg": dict}} for *text*."""
+    sentences = [s for s, _, _ in split_into_sentences(text)]
+    simplified = [
+        remove_think_block(reply)
+        for reply in simplify_text_many(
+            sentences, model, max_concurrency=LLM_CONCURRENCY
+        )
+    ]
+    kg_texts = create_knowledge_ontology_batch(
+        simplified,
+        model,
+        batch_size=ONTOLOGY_BATCH_SIZE,
+        max_concurrency=LLM_CONCURRENCY,
+    )
     results = []
-    for sentence in split_into_sentences(text):
-        simplified = remove_think_block(simplify_text(sentence, model))
-        kg_text = remove_think_block(create_knowledge_ontology(simplified, model))
-        kg_json = json.loads(_extract_json_block(kg_text))
+    for sentence, kg_text in zip(sentences, kg_texts):
+        kg_json = _parse_llm_json(remove_think_block(kg_text))
         results.append({"sentence": sentence, "kg": kg_json})
     return results
 
@@ -27,9 +42,10 @@ def sentence_kgs(text: str, model) -> list[dict]:
 def main(path: Path, out: Path) -> None:
     text = extract_text(path)
     model = build_llm()
+    warm_up(model)
     kgs = sentence_kgs(text, model)
     out.parent.mkdir(parents=True, exist_ok=True)
-    out.write_text(json.dumps(kgs, indent=2, ensure_ascii=False), encoding="utf-8")
+    _write_atomic(out, _dumps(kgs))
     print(f"Saved {len(kgs)} sentence KGs to {out}")
 
 